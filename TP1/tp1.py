@@ -24,10 +24,22 @@ import sys, os
 import matplotlib.pyplot as plt
 import numpy as np
 import sys
+from collections import OrderedDict
+from matplotlib.collections import LineCollection
+
+# optional : KD-tree for the closest-point queries, see ProjectPoints()
+try :
+    from scipy.spatial import cKDTree
+except ImportError :
+    cKDTree = None
 
 TP = os.path.dirname(os.path.realpath(__file__)) + "/"
 DATADIR = filename = TP+"data/"
 
+# bounded LRU cache of Bernstein matrices, see BernsteinMatrix()
+BERNSTEIN_CACHE = OrderedDict()
+BERNSTEIN_CACHE_SIZE = 32
+
 #-------------------------------------------------
 # READPOLYGON()
 # Read Bezier control points from a file.
@@ -35,7 +47,7 @@ DATADIR = filename = TP+"data/"
 def ReadPolygon( filename ) :
     datafile = open(filename,'r');
     l = datafile.readline()
-    degree = np.fromstring(l,sep=' ',dtype=int)
+    degree = int(l)
     BezierPts = np.fromfile(datafile,count=2*(degree+1),sep=' ',dtype=float)
     BezierPts = BezierPts.reshape(-1,2)
     return BezierPts
@@ -66,13 +78,280 @@ def DeCasteljauIterative( BezierPts, k, i, t ) :
     return BezierPts[i]
 def DeCasteljauRecursive( BezierPts, k, i, t ) :
 
-    if k!=0 :
-        # return the i-th point of intermediary levels
-        return (1-t)*DeCasteljauRecursive(BezierPts, k-1, i, t) \
-         + t*DeCasteljauRecursive(BezierPts, k-1, i+1, t)
-    else :
-        # return the i-th point of first levels
-        return BezierPts[i]
+    # same points as the recursion, in O(k^2) : iterate on a copy of b_i..b_i+k
+    return DeCasteljauIterative( np.array(BezierPts[i:i+k+1],dtype=float), k, 0, t )
+
+#-------------------------------------------------
+# FORWARDDIFFERENCES( ... )
+# Evaluate the Bezier curve at N uniform samples by forward differencing.
+# Once the difference table is set up from the derivatives at the first
+# sample, each new point costs only `degree` additions.
+# Rounding errors accumulate along the run, so the table is re-anchored
+# on exact De Casteljau points every `anchor` samples. A block whose last
+# point drifts from the De Casteljau reference by more than `tol`
+# is recomputed with half the length; if even the shortest block
+# (degree+1 samples) fails, which happens for high degrees, the remaining
+# samples are evaluated with DeCasteljauBatch instead and the reported
+# error is np.inf, so that callers can tell forward differencing was
+# not usable for this curve.
+#
+# Input
+#    BezierPts :  (degree+1) x 2 matrix of Bezier control points
+#    N         :  number of curve samples
+#    anchor    :  maximal number of samples between two re-anchorings
+#    tol       :  tolerated drift at the end of a block
+#
+# Output
+#    CurvePts  :  N x 2 matrix of curvepoints
+#    error     :  max distance to the De Casteljau reference (block ends),
+#                 np.inf if the De Casteljau fallback was used
+#
+def ForwardDifferences( BezierPts, N, anchor=65536, tol=1e-9 ) :
+
+    degree = BezierPts.shape[0]-1
+    h = 1.0/(N-1) if N > 1 else 0.0
+    CurvePts = np.empty([N,BezierPts.shape[1]])
+    error = 0.0
+
+    # control polygons of the derivatives, up to scaling
+    Diffs = [BezierPts]
+    for k in range(1,degree+1) :
+        Diffs.append(Diffs[-1][1:]-Diffs[-1][:-1])
+
+    # Delta^j f = j! sum_k S(k,j) h^k f^(k)/k!  with S the Stirling numbers
+    # of the second kind, and f^(k)/k! = C(degree,k) * (Diffs[k] curve)
+    Stirling = np.zeros([degree+1,degree+1])
+    Stirling[0,0] = 1.0
+    for k in range(1,degree+1) :
+        Stirling[k,1:k+1] = np.arange(1,k+1)*Stirling[k-1,1:k+1] + Stirling[k-1,0:k]
+    k = np.arange(degree+1)
+    factorial = np.cumprod(np.maximum(k,1).astype(float))
+    binomial = factorial[degree]/(factorial[k]*factorial[degree-k])
+    Coef = factorial.reshape(-1,1) * Stirling.T * (h**k*binomial)
+
+    start = 0
+    length = anchor
+    while start < N :
+        length = min(2*length,anchor,N-start)
+        while True :
+            # difference table Delta^j b(t_start), j=0,...,degree
+            Taylor = np.array([ DeCasteljauBatch(Diffs[j],[start*h])[0] for j in range(0,degree+1) ])
+            Table = Coef.dot(Taylor)
+
+            # Delta^j += Delta^(j+1) for each step, written as running sums
+            Run = np.empty([length,BezierPts.shape[1]])
+            Run[:] = Table[degree]
+            for j in range(degree-1,-1,-1) :
+                Run[1:] = Run[:-1]
+                Run[0] = Table[j]
+                np.cumsum(Run,axis=0,out=Run)
+
+            # compare the last point of the block with De Casteljau
+            last = DeCasteljauBatch(BezierPts,[(start+length-1)*h])[0]
+            drift = np.sqrt(np.sum((Run[-1]-last)**2))
+            if np.isfinite(drift) and drift <= tol :
+                break
+            if length <= degree+1 :
+                # forward differencing failed : exact points for the rest
+                length = N-start
+                Run = DeCasteljauBatch(BezierPts,np.arange(start,N)*h)
+                drift = np.inf
+                break
+            length = max(length//2,degree+1)
+
+        CurvePts[start:start+length] = Run
+        if not drift <= error :
+            error = drift
+        start += length
+
+    return CurvePts, error
+
+#-------------------------------------------------
+# DECASTELJAUBATCH( ... )
+# Perform the De Casteljau algorithm for a whole array of parameters.
+# The triangle is computed on a (chunk, degree+1, dim) tensor,
+# one depth at a time, for `chunk` samples at once ; the buffers
+# are allocated once and reused, so memory stays bounded for large N.
+#
+# Input
+#    BezierPts :  (degree+1) x dim matrix of Bezier control points
+#    samples   :  vector of N curve parameters in [0.0,1.0]
+#    chunk     :  number of samples evaluated at once
+#
+# Output
+#    CurvePts  :  N x dim matrix of curve points b_0^degree(t)
+#
+def DeCasteljauBatch( BezierPts, samples, chunk=4096 ) :
+
+    samples = np.asarray(samples,dtype=float).reshape(-1)
+    degree = BezierPts.shape[0]-1
+    N = samples.shape[0]
+    chunk = max(1,min(chunk,N))
+
+    # one copy of the control polygon per sample of the chunk
+    Work = np.empty([chunk,degree+1,BezierPts.shape[1]])
+    Tmp = np.empty_like(Work)
+    CurvePts = np.empty([N,BezierPts.shape[1]])
+
+    for start in range(0,N,chunk) :
+        n = min(chunk,N-start)
+        Work[:n] = BezierPts
+        CurvePts[start:start+n] = DeCasteljauInPlace( Work[:n], samples[start:start+n], None, Tmp[:n] )
+
+    return CurvePts
+
+#-------------------------------------------------
+# DECASTELJAUINPLACE( ... )
+# Run the De Casteljau triangle on a stack of control polygons,
+# overwriting the stack with the intermediate points.
+#
+# Input
+#    Work      :  N x (degree+1) x dim tensor, one control polygon per sample
+#    samples   :  vector of N curve parameters
+#    Deriv     :  optional N x dim buffer receiving the first derivative
+#    Tmp       :  optional scratch buffer of the same shape as Work
+#
+# Output
+#    N x dim view of the curve points (first column of Work)
+#
+def DeCasteljauInPlace( Work, samples, Deriv=None, Tmp=None ) :
+
+    degree = Work.shape[1]-1
+    t = samples.reshape(-1,1,1)
+    s = 1.0-t
+    if Tmp is None :
+        Tmp = np.empty_like(Work)
+    if Deriv is not None and degree == 0 :
+        Deriv[:] = 0.0
+
+    # b_column = (1-t)*b_column + t*b_(column+1), for all samples at once
+    for depth in range(0,degree):
+        k = degree-depth
+
+        # b'(t) = degree * (b_1^(degree-1) - b_0^(degree-1))
+        if k == 1 and Deriv is not None :
+            np.subtract(Work[:,1],Work[:,0],out=Deriv)
+            Deriv *= degree
+
+        np.multiply(t,Work[:,1:k+1],out=Tmp[:,:k])
+        np.multiply(s,Work[:,:k],out=Work[:,:k])
+        np.add(Work[:,:k],Tmp[:,:k],out=Work[:,:k])
+
+    return Work[:,0]
+
+#-------------------------------------------------
+# BEZIERCURVECHUNKS( ... )
+# Generator over the uniform samples of the Bezier curve,
+# yielding chunks of at most `chunk` points, so that very long
+# sample runs can be streamed to disk with constant memory.
+# All buffers are allocated once : the yielded arrays are overwritten
+# by the next chunk and must be copied if they are to be kept.
+#
+# Input
+#    BezierPts   :  (degree+1) x dim matrix of Bezier control points
+#    N           :  total number of curve samples
+#    chunk       :  number of samples per chunk
+#    derivatives :  if True, also yield the first derivatives
+#
+# Output (yield)
+#    CurvePts              :  n x dim matrix of curvepoints, n <= chunk
+#    CurvePts, CurveDers   :  if derivatives
+#
+def BezierCurveChunks( BezierPts, N, chunk=4096, derivatives=False ) :
+
+    degree = BezierPts.shape[0]-1
+    dim = BezierPts.shape[1]
+    chunk = max(1,min(chunk,N))
+    step = 1.0/(N-1) if N > 1 else 0.0
+
+    # preallocated buffers, reused by every chunk
+    Work = np.empty([chunk,degree+1,dim])
+    Tmp = np.empty_like(Work)
+    Index = np.arange(chunk,dtype=float)
+    samples = np.empty(chunk)
+    CurvePts = np.empty([chunk,dim])
+    CurveDers = np.empty([chunk,dim]) if derivatives else None
+
+    for start in range(0,N,chunk) :
+        n = min(chunk,N-start)
+
+        # same parameters as np.linspace(0.0,1.0,num=N)
+        np.add(Index[:n],start,out=samples[:n])
+        samples[:n] *= step
+        if start+n == N and N > 1 :
+            samples[n-1] = 1.0
+
+        Work[:n] = BezierPts
+        CurvePts[:n] = DeCasteljauInPlace( Work[:n], samples[:n],
+            CurveDers[:n] if derivatives else None, Tmp[:n] )
+
+        if derivatives :
+            yield CurvePts[:n], CurveDers[:n]
+        else :
+            yield CurvePts[:n]
+
+#-------------------------------------------------
+# BERNSTEINBASIS( ... )
+# Compute the Bernstein polynomials B_i^degree(t) at arbitrary parameters
+# (no caching). The recurrence runs on a (degree+1) x N array,
+# so that each step works on contiguous rows.
+#
+# Input
+#    degree    :  degree of the Bernstein basis
+#    samples   :  vector of N curve parameters
+#
+# Output
+#    B         :  N x (degree+1) matrix, B[j,i] = B_i^degree(samples[j])
+#
+def BernsteinBasis( degree, samples ) :
+
+    t = np.asarray(samples,dtype=float).reshape(-1)
+    s = 1.0-t
+
+    # B_i^k = (1-t)*B_i^(k-1) + t*B_(i-1)^(k-1), starting from B_0^0 = 1
+    B = np.zeros([degree+1,t.shape[0]])
+    B[0] = 1.0
+    for k in range(1,degree+1) :
+        B[1:k+1] = s*B[1:k+1] + t*B[0:k]
+        B[0] *= s
+
+    return B.T
+
+#-------------------------------------------------
+# BERNSTEINMATRIX( ... )
+# Compute the matrix of Bernstein polynomials B_i^degree(t)
+# evaluated at the given samples, so that curve points are
+# obtained as  B @ BezierPts.
+# Matrices are kept in a bounded LRU cache keyed by (degree, samples),
+# and are returned read-only.
+#
+# Input
+#    degree    :  degree of the Bernstein basis
+#    samples   :  vector of N curve parameters in [0.0,1.0]
+#
+# Output
+#    B         :  N x (degree+1) matrix, B[j,i] = B_i^degree(samples[j])
+#
+def BernsteinMatrix( degree, samples ) :
+
+    samples = np.ascontiguousarray(samples,dtype=float).reshape(-1)
+    key = (degree, samples.tobytes())
+
+    # cache hit : move the entry to the most recently used position
+    if key in BERNSTEIN_CACHE :
+        B = BERNSTEIN_CACHE.pop(key)
+        BERNSTEIN_CACHE[key] = B
+        return B
+
+    B = BernsteinBasis(degree,samples)
+    B.setflags(write=False)
+
+    # evict the least recently used matrix
+    BERNSTEIN_CACHE[key] = B
+    if len(BERNSTEIN_CACHE) > BERNSTEIN_CACHE_SIZE :
+        BERNSTEIN_CACHE.popitem(last=False)
+
+    return B
 
 #-------------------------------------------------
 # BEZIERCURVE( ... )
@@ -81,32 +360,521 @@ def DeCasteljauRecursive( BezierPts, k, i, t ) :
 # Input
 #    BezierPts :  (degree+1) x 2 matrix of Bezier control points
 #    N         :  number of curve samples
+#    method    :  'rec', 'it' or 'batch' De Casteljau, 'bernstein' matrix
+#                 or 'fd' forward differences
 #    
 # Output
 #    CurvePts  :  N x 2 matrix of curvepoints
 #
-def BezierCurve( BezierPts, N ) :
+def BezierCurve( BezierPts, N, method='batch' ) :
     
     # degree of the curve (one less than the number of control points)
     degree = BezierPts.shape[0]-1
     
-    # initialize curvepoints as zeros
-    CurvePts = np.zeros([N,2])
-
     # generate the uniform sampling of the interval [0.0,1.0] with N elements
     samples = np.linspace(0.0,1.0,num=N)
     # print (samples)
 
+    # all samples, chunk by chunk
+    if method == 'batch' :
+        return DeCasteljauBatch(BezierPts,samples)
+
+    # one matrix product with the cached basis
+    if method == 'bernstein' :
+        return BernsteinMatrix(degree,samples).dot(BezierPts)
+
+    # incremental evaluation for long uniform runs
+    if method == 'fd' :
+        return ForwardDifferences(BezierPts,N)[0]
+
+    # initialize curvepoints as zeros
+    CurvePts = np.zeros([N,2])
+
     # compute N curve points for t varying uniformly in [0.0,1.0]
     for i in range(0,N):
         points = np.copy(BezierPts)
-        if rec == True :
+        if method == 'rec' :
             CurvePts[i] = DeCasteljauRecursive(points,degree,0,samples[i])
         else :
             CurvePts[i] = DeCasteljauIterative(points,degree,0,samples[i])
     
     return CurvePts
 
+#-------------------------------------------------
+# BEZIERCURVEBATCH( ... )
+# Evaluate a family of Bezier curves at shared parameters.
+# Curves of the same degree are evaluated together with one product
+# with the cached Bernstein matrix; a ragged list of control polygons
+# is grouped by degree first.
+#
+# Input
+#    Polygons  :  C x (degree+1) x dim stack of control polygons,
+#                 or a list of C polygons of (possibly) different degrees
+#    samples   :  vector of N curve parameters in [0.0,1.0]
+#    rational  :  if True, the last coordinate is the weight,
+#                 i.e. control points are [ x, y, (z,) w ]
+#
+# Output
+#    CurvePts  :  C x N x dim matrix of curvepoints (dim-1 if rational)
+#
+def BezierCurveBatch( Polygons, samples, rational=False ) :
+
+    samples = np.asarray(samples,dtype=float).reshape(-1)
+
+    # ragged input : evaluate each group of same-degree polygons at once
+    if not isinstance(Polygons,np.ndarray) :
+        Polygons = [ np.asarray(P,dtype=float) for P in Polygons ]
+        dim = Polygons[0].shape[1] - (1 if rational else 0)
+        CurvePts = np.empty([len(Polygons),samples.shape[0],dim])
+        degrees = np.array([ P.shape[0]-1 for P in Polygons ])
+        for degree in np.unique(degrees) :
+            index = np.flatnonzero(degrees==degree)
+            Group = np.array([ Polygons[i] for i in index ])
+            CurvePts[index] = BezierCurveBatch( Group, samples, rational )
+        return CurvePts
+
+    B = BernsteinMatrix(Polygons.shape[1]-1,samples)
+
+    # rational curves : evaluate in homogeneous coordinates [ w*x, w*y, w ]
+    if rational :
+        W = Polygons[:,:,-1:]
+        H = np.concatenate( [Polygons[:,:,:-1]*W, W], axis=2 )
+        H = np.matmul(B,H)
+        return H[:,:,:-1]/H[:,:,-1:]
+
+    return np.matmul(B,Polygons)
+
+#-------------------------------------------------
+# BEZIERDERIVATIVES( ... )
+# Compute points, first and second derivatives of the Bezier curve
+# at the given parameters. The derivatives are Bezier curves
+# of the (scaled) differences of the control points.
+#
+# Input
+#    BezierPts :  (degree+1) x dim matrix of Bezier control points
+#    samples   :  vector of N curve parameters in [0.0,1.0]
+#
+# Output
+#    CurvePts, CurveDers, CurveDers2  :  three N x dim matrices
+#
+def BezierDerivatives( BezierPts, samples ) :
+
+    # degree elevation of points and lines to quadratics
+    BezierPts = np.asarray(BezierPts,dtype=float)
+    while BezierPts.shape[0] < 3 :
+        a = np.arange(1,BezierPts.shape[0]).reshape(-1,1)/float(BezierPts.shape[0])
+        BezierPts = np.concatenate([ BezierPts[:1], a*BezierPts[:-1]+(1-a)*BezierPts[1:], BezierPts[-1:] ])
+
+    degree = BezierPts.shape[0]-1
+    t = np.asarray(samples,dtype=float).reshape(-1,1)
+    s = 1.0-t
+
+    # the three points b_0, b_1, b_2 of level degree-2 ...
+    B = BernsteinBasis(degree-2,t)
+    L0 = B.dot(BezierPts[0:degree-1])
+    L1 = B.dot(BezierPts[1:degree])
+    L2 = B.dot(BezierPts[2:degree+1])
+
+    # ... and the two last steps of the De Casteljau algorithm
+    M0 = s*L0 + t*L1
+    M1 = s*L1 + t*L2
+    CurvePts = s*M0 + t*M1
+    CurveDers = degree*(M1-M0)
+    CurveDers2 = degree*(degree-1)*(L2-2*L1+L0)
+
+    return CurvePts, CurveDers, CurveDers2
+
+#-------------------------------------------------
+# PROJECTPOINTS( ... )
+# Closest-point projection of many query points onto the Bezier curve.
+# Initial guesses are the nearest of `density` uniform curve samples,
+# found with a KD-tree (if scipy is available) or by brute force.
+# All the guesses are then refined together by Newton iterations on
+#    f(t) = b'(t).(b(t)-q) = 0,  t clamped to [0,1].
+#
+# Input
+#    BezierPts   :  (degree+1) x dim matrix of Bezier control points
+#    QueryPts    :  M x dim matrix of query points
+#    density     :  number of curve samples in the index
+#    iterations  :  number of Newton iterations
+#    chunk       :  number of queries refined at once
+#
+# Output
+#    samples     :  vector of M curve parameters of the closest points
+#    distances   :  vector of M distances to the curve
+#    FootPts     :  M x dim matrix of closest points on the curve
+#
+def ProjectPoints( BezierPts, QueryPts, density=None, iterations=8, chunk=65536 ) :
+
+    degree = BezierPts.shape[0]-1
+    QueryPts = np.asarray(QueryPts,dtype=float)
+    M = QueryPts.shape[0]
+    if density is None :
+        density = 64*(degree+1)
+
+    # index of dense curve samples
+    params = np.linspace(0.0,1.0,num=density)
+    Samples = DeCasteljauBatch(BezierPts,params)
+    tree = cKDTree(Samples) if cKDTree is not None else None
+
+    samples = np.empty(M)
+    distances = np.empty(M)
+    FootPts = np.empty_like(QueryPts)
+
+    for start in range(0,M,chunk) :
+        Q = QueryPts[start:start+chunk]
+
+        # initial guess : nearest sample
+        if tree is not None :
+            nearest = tree.query(Q)[1]
+        else :
+            nearest = np.empty(Q.shape[0],dtype=int)
+            for s in range(0,Q.shape[0],1024) :
+                D = np.sum( (Q[s:s+1024,np.newaxis,:]-Samples[np.newaxis,:,:])**2, axis=2 )
+                nearest[s:s+1024] = np.argmin(D,axis=1)
+        t = params[nearest]
+        best_t = t.copy()
+        best_d = np.sum((Samples[nearest]-Q)**2,axis=1)
+
+        # Newton on the squared distance, keeping the best iterate
+        for it in range(0,iterations) :
+            C, D1, D2 = BezierDerivatives(BezierPts,t)
+            V = C-Q
+            d = np.sum(V*V,axis=1)
+            better = d < best_d
+            best_t[better] = t[better]
+            best_d[better] = d[better]
+
+            g = np.sum(D1*V,axis=1)
+            h = np.sum(D1*D1,axis=1) + np.sum(D2*V,axis=1)
+            step = np.where( h > 0, g/np.where(h > 0,h,1.0), 0.0 )
+            t = np.clip(t-step,0.0,1.0)
+
+        C = BezierDerivatives(BezierPts,t)[0]
+        d = np.sum((C-Q)**2,axis=1)
+        better = d < best_d
+        best_t[better] = t[better]
+
+        samples[start:start+chunk] = best_t
+        FootPts[start:start+chunk] = BezierDerivatives(BezierPts,best_t)[0]
+        distances[start:start+chunk] = np.sqrt(np.sum((FootPts[start:start+chunk]-Q)**2,axis=1))
+
+    return samples, distances, FootPts
+
+#-------------------------------------------------
+# SUBDIVIDE( ... )
+# Split the Bezier curve at t with the De Casteljau algorithm.
+# The control polygon of the left part is formed by the first points
+# of the intermediate polygons, that of the right part by the last ones.
+#
+# Input
+#    BezierPts :  (degree+1) x 2 matrix of Bezier control points
+#    t         :  split parameter in [0.0,1.0]
+#
+# Output
+#    Left      :  (degree+1) x 2 control points of the curve on [0,t]
+#    Right     :  (degree+1) x 2 control points of the curve on [t,1]
+#
+def Subdivide( BezierPts, t=0.5 ) :
+
+    degree = BezierPts.shape[0]-1
+    points = np.array(BezierPts,dtype=float)
+    Left = np.empty_like(points)
+    Right = np.empty_like(points)
+    Left[0] = points[0]
+    Right[degree] = points[degree]
+
+    for depth in range(1,degree+1) :
+        points = (1-t)*points[:-1] + t*points[1:]
+        Left[depth] = points[0]
+        Right[degree-depth] = points[-1]
+
+    return Left, Right
+
+#-------------------------------------------------
+# FLATNESS( ... )
+# Max distance of the control points to the chord [b_0,b_degree].
+# By the convex hull property, this bounds the distance
+# of the curve to the chord.
+#
+def Flatness( BezierPts ) :
+
+    A = BezierPts[0]
+    chord = BezierPts[-1]-A
+    length2 = np.dot(chord,chord)
+    if length2 > 0 :
+        s = np.clip( (BezierPts-A).dot(chord)/length2, 0.0, 1.0 )
+    else :
+        s = np.zeros(BezierPts.shape[0])
+    return np.sqrt( np.max( np.sum((BezierPts-A-s.reshape(-1,1)*chord)**2,axis=1) ) )
+
+#-------------------------------------------------
+# ADAPTIVEBEZIERCURVE( ... )
+# Compute a polyline approximating the Bezier curve within tolerance.
+# The control polygon is split at t=0.5 until each piece is flat,
+# so that flat parts get few samples and tight loops get many.
+#
+# Input
+#    BezierPts :  (degree+1) x 2 matrix of Bezier control points
+#    tol       :  max distance between the curve and the polyline
+#    maxdepth  :  max number of successive subdivisions
+#
+# Output
+#    CurvePts  :  M x 2 matrix of curvepoints (M depends on tol)
+#    stats     :  dictionary with the number of 'samples' and 'pieces',
+#                 the max subdivision 'depth' and the bound on the 'error'
+#
+def AdaptiveBezierCurve( BezierPts, tol, maxdepth=20 ) :
+
+    CurvePts = [ np.array(BezierPts[0],dtype=float) ]
+    stats = { 'samples' : 1, 'pieces' : 0, 'depth' : 0, 'error' : 0.0 }
+
+    # depth-first, left pieces first, so that the points come out in order
+    stack = [ (np.array(BezierPts,dtype=float), 0) ]
+    while stack :
+        points, depth = stack.pop()
+        error = Flatness(points)
+        if error <= tol or depth >= maxdepth :
+            CurvePts.append(points[-1])
+            stats['pieces'] += 1
+            stats['depth'] = max(stats['depth'],depth)
+            stats['error'] = max(stats['error'],error)
+        else :
+            Left, Right = Subdivide(points,0.5)
+            stack.append( (Right, depth+1) )
+            stack.append( (Left, depth+1) )
+
+    stats['samples'] = len(CurvePts)
+    return np.array(CurvePts), stats
+
+#-------------------------------------------------
+# SWEEPANDPRUNE( ... )
+# Find the pairs of overlapping axis-aligned boxes.
+# The sweep runs along the axis with the largest spread of box centres :
+# boxes are sorted by their lower coordinate on that axis, each box is
+# then only paired with the boxes starting before its upper coordinate,
+# and the pairs are filtered on all axes. Candidate pairs are generated
+# in blocks of about `block` pairs, so memory stays bounded.
+#
+# Input
+#    Lower, Upper  :  k x dim matrices of box corners
+#    block         :  number of candidate pairs filtered at once
+#
+# Output
+#    I, J          :  index vectors of the overlapping pairs (I != J)
+#
+def SweepAndPrune( Lower, Upper, block=2**20 ) :
+
+    k = Lower.shape[0]
+    axis = np.argmax( np.var(Lower+Upper,axis=0) ) if k > 0 else 0
+    order = np.argsort(Lower[:,axis],kind='mergesort')
+    Lower = Lower[order]
+    Upper = Upper[order]
+
+    # boxes i+1,...,end[i]-1 start before box i ends
+    end = np.searchsorted(Lower[:,axis],Upper[:,axis],side='right')
+    count = np.maximum(end-np.arange(k)-1,0)
+    total = np.cumsum(count)
+
+    # boxes first,...,last-1 give about `block` candidate pairs
+    Is, Js = [], []
+    first = 0
+    while first < k :
+        last = max( np.searchsorted(total,total[first]-count[first]+block,side='right'), first+1 )
+        c = count[first:last]
+        I = np.repeat(np.arange(first,last),c)
+        offset = np.repeat(np.cumsum(c)-c,c)
+        J = I+1 + np.arange(I.shape[0])-offset
+
+        overlap = np.all( (Lower[J] <= Upper[I]) & (Lower[I] <= Upper[J]), axis=1 )
+        Is.append( order[I[overlap]] )
+        Js.append( order[J[overlap]] )
+        first = last
+
+    if not Is :
+        return np.zeros(0,dtype=int), np.zeros(0,dtype=int)
+    return np.concatenate(Is), np.concatenate(Js)
+
+#-------------------------------------------------
+# CHORDINTERSECTION( ... )
+# Intersect the segments [A0,A1] and [B0,B1] (2D).
+#
+# Output
+#    (u,v) such that A0+u*(A1-A0) = B0+v*(B1-B0), or None if parallel
+#
+def ChordIntersection( A0, A1, B0, B1 ) :
+
+    a = A1-A0
+    b = B1-B0
+    c = B0-A0
+    det = a[0]*b[1]-a[1]*b[0]
+    if abs(det) <= 1e-14*np.sqrt(np.dot(a,a)*np.dot(b,b)) :
+        return None
+    u = (c[0]*b[1]-c[1]*b[0])/det
+    v = (c[0]*a[1]-c[1]*a[0])/det
+    return u, v
+
+#-------------------------------------------------
+# BEZIERPAIRINTERSECTIONS( ... )
+# Intersections of two Bezier curves (2D) by recursive subdivision.
+# Pairs of sub-curves whose control-polygon bounding boxes do not overlap
+# are discarded; when both sub-curves are flat, their chords are
+# intersected and the hit is polished by Newton iterations on
+#    b(t) - c(s) = 0.
+# Known common endpoints (e.g. the joint of consecutive spline segments)
+# can be given as `joints` : a sub-curve pair touching a joint is dropped
+# as soon as a line through the joint separates the rest of the two
+# control polygons, or when both are flat ; hits on the joint are dropped.
+#
+# Input
+#    BezierPts, OtherPts  :  control polygons of the two curves
+#    tol                  :  tolerance on the distance b(t)-c(s)
+#    maxdepth             :  max number of successive subdivisions
+#    joints               :  list of (t,s) in {0,1}x{0,1} with b(t) = c(s)
+#
+# Output
+#    list of (t,s) parameter pairs, sorted by t
+#
+def BezierPairIntersections( BezierPts, OtherPts, tol=1e-9, maxdepth=40, joints=() ) :
+
+    # flatness at which chords are close enough for Newton
+    extent = np.max( np.ptp(np.concatenate([BezierPts,OtherPts]),axis=0) )
+    flat = 1e-3*extent
+
+    guesses = []
+    stack = [ (BezierPts,0.0,1.0,OtherPts,0.0,1.0,0) ]
+    while stack :
+        A, a0, a1, B, b0, b1, depth = stack.pop()
+
+        # bounding boxes of the control polygons
+        if np.any( A.min(axis=0) > B.max(axis=0)+tol ) or np.any( B.min(axis=0) > A.max(axis=0)+tol ) :
+            continue
+
+        # sub-curves meeting at a joint
+        touching = [ (tj,sj) for tj, sj in joints
+                     if (a0 if tj == 0.0 else a1) == tj and (b0 if sj == 0.0 else b1) == sj ]
+        separated = False
+        for tj, sj in touching :
+            # the line through the joint, normal to d, separates the rest
+            # of the polygons : the joint is their only common point
+            Ra = A[1:] if tj == 0.0 else A[:-1]
+            Rb = B[1:] if sj == 0.0 else B[:-1]
+            X = A[0] if tj == 0.0 else A[-1]
+            d = (Rb[0] if sj == 0.0 else Rb[-1]) - (Ra[0] if tj == 0.0 else Ra[-1])
+            if np.max((Ra-X).dot(d)) < 0.0 and np.min((Rb-X).dot(d)) > 0.0 :
+                separated = True
+        if separated :
+            continue
+
+        fa = Flatness(A)
+        fb = Flatness(B)
+        if (fa <= flat and fb <= flat) or depth >= maxdepth :
+            # flat sub-curves meeting at a joint : only the joint itself
+            if touching :
+                continue
+            uv = ChordIntersection(A[0],A[-1],B[0],B[-1])
+            if uv is not None and -0.1 <= uv[0] <= 1.1 and -0.1 <= uv[1] <= 1.1 :
+                u, v = np.clip(uv,0.0,1.0)
+                guesses.append( (a0+u*(a1-a0), b0+v*(b1-b0)) )
+            continue
+
+        # split the less flat of the two curves
+        if fa >= fb :
+            L, R = Subdivide(A,0.5)
+            am = 0.5*(a0+a1)
+            stack.append( (L,a0,am,B,b0,b1,depth+1) )
+            stack.append( (R,am,a1,B,b0,b1,depth+1) )
+        else :
+            L, R = Subdivide(B,0.5)
+            bm = 0.5*(b0+b1)
+            stack.append( (A,a0,a1,L,b0,bm,depth+1) )
+            stack.append( (A,a0,a1,R,bm,b1,depth+1) )
+
+    # Newton polishing, duplicates (hits on split points) are merged
+    hits = []
+    for t, s in guesses :
+        for it in range(0,21) :
+            P, dP = BezierDerivatives(BezierPts,[t])[0:2]
+            Q, dQ = BezierDerivatives(OtherPts,[s])[0:2]
+            F = (P-Q)[0]
+            if np.sqrt(np.dot(F,F)) <= tol or it == 20 :
+                break
+            J = np.array([ dP[0], -dQ[0] ]).T
+            if abs(np.linalg.det(J)) < 1e-300 :
+                break
+            dt, ds = np.linalg.solve(J,F)
+            t = min(max(t-dt,0.0),1.0)
+            s = min(max(s-ds,0.0),1.0)
+        if np.sqrt(np.dot(F,F)) > tol :
+            continue
+        if any( abs(t-tj)+abs(s-sj) <= 1e-6 for tj, sj in joints ) :
+            continue
+        if all( abs(t-h[0])+abs(s-h[1]) > 1e-6 for h in hits ) :
+            hits.append( (float(t),float(s)) )
+
+    return sorted(hits)
+
+#-------------------------------------------------
+# BEZIERINTERSECTIONS( ... )
+# Intersections within a set of Bezier curves (2D), or between two sets.
+# Candidate pairs are found by sweep-and-prune on the bounding boxes
+# of the control polygons, so that only curves with overlapping boxes
+# are intersected with BezierPairIntersections().
+# Consecutive segments of a spline meet at their common point : with
+# `skipjoints`, the shared endpoint of Curves[i] and Curves[i+1]
+# (and of the last and first curve, for closed splines) is not reported.
+#
+# Input
+#    Curves     :  list (or stack) of control polygons
+#    Others     :  optional second list; if None, pairs within Curves
+#    tol        :  tolerance on the distance between the curves
+#    skipjoints :  drop the joints of consecutive curves,
+#                  default True for a single set, False for two sets
+#
+# Output
+#    list of (i,j,t,s,point) : Curves[i](t) = Others[j](s) = point
+#
+def BezierIntersections( Curves, Others=None, tol=1e-9, skipjoints=None ) :
+
+    Curves = [ np.asarray(P,dtype=float) for P in Curves ]
+    if skipjoints is None :
+        skipjoints = Others is None
+    if Others is None :
+        Sets = Curves
+    else :
+        Others = [ np.asarray(P,dtype=float) for P in Others ]
+        Sets = Curves + Others
+
+    Lower = np.array([ P.min(axis=0) for P in Sets ]) - tol
+    Upper = np.array([ P.max(axis=0) for P in Sets ]) + tol
+    I, J = SweepAndPrune(Lower,Upper)
+
+    # keep pairs across the two sets, ordered as (Curves,Others)
+    if Others is not None :
+        c = len(Curves)
+        I, J = np.minimum(I,J), np.maximum(I,J)
+        across = (I < c) & (J >= c)
+        I, J = I[across], J[across]-c
+        Second = Others
+    else :
+        I, J = np.minimum(I,J), np.maximum(I,J)
+        Second = Curves
+
+    result = []
+    last = len(Second)-1
+    for i, j in sorted(zip(I.tolist(),J.tolist())) :
+        joints = []
+        if skipjoints :
+            if j == i+1 and np.array_equal(Curves[i][-1],Second[j][0]) :
+                joints.append( (1.0,0.0) )
+            if i == 0 and j == last and np.array_equal(Curves[i][0],Second[j][-1]) :
+                joints.append( (0.0,1.0) )
+        for t, s in BezierPairIntersections(Curves[i],Second[j],tol,joints=joints) :
+            point = BezierDerivatives(Curves[i],[t])[0][0]
+            result.append( (i,j,t,s,point) )
+
+    return result
+
 #-------------------------------------------------
 # POLYGONPRINTER( ... )
 # Compute intermediate polygons and
@@ -115,29 +883,84 @@ def BezierCurve( BezierPts, N ) :
 #
 # Input
 #    BezierPts :  (degree+1) x 2 matrix of Bezier control points
+#    t         :  curve parameter in [0.0,1.0]
+#    ax        :  matplotlib axes (current axes by default)
+#    artists   :  (lines, marks) of a previous call, updated in place
+#
+# Output
+#    lines, marks  :  the LineCollection and the vertex markers
 #
-def PolygonPrinter( BezierPts ) :
-    # get number of segments
-    N = BezierPts.shape[0]-1
+def PolygonPrinter( BezierPts, t=0.5, ax=None, artists=None ) :
+    return TrianglePrinter( DeCasteljauTriangle(BezierPts,[t])[0], ax, artists )
 
-    # fix the value of t
-    t = 0.5
+#-------------------------------------------------
+# DECASTELJAUTRIANGLE( ... )
+# Compute the whole De Casteljau triangle for one or several values of t,
+# e.g. all the frames of an animation.
+#
+# Input
+#    BezierPts :  (degree+1) x dim matrix of Bezier control points
+#    samples   :  vector of T curve parameters
+#
+# Output
+#    Triangle  :  T x (degree+1) x (degree+1) x dim tensor,
+#                 Triangle[:,k,i] = b_i^k for i=0,...,degree-k (NaN elsewhere)
+#
+def DeCasteljauTriangle( BezierPts, samples ) :
 
-    # copy the original array with Bezier points
-    points = np.copy(BezierPts)
+    degree = BezierPts.shape[0]-1
+    t = np.asarray(samples,dtype=float).reshape(-1,1,1)
+    Triangle = np.full([t.shape[0],degree+1,degree+1,BezierPts.shape[1]],np.nan)
+    Triangle[:,0] = BezierPts
 
-    for depth in range(0,N):
-        
-        # compute points of the next polygon
-        for column in range(0,N-depth):
-            points[column] = (1-t)*points[column] + t*points[column+1]
+    for k in range(1,degree+1) :
+        Triangle[:,k,:degree+1-k] = (1-t)*Triangle[:,k-1,:degree+1-k] + t*Triangle[:,k-1,1:degree+2-k]
 
-        # omit the last point since it's no longer useful
-        points = points[:-1]
-        
-        # print all intermediate polygons
-        plt.plot(points[:,0], points[:,1], '-o', 
-            linewidth=1.2 if depth%2.0==0 else 0.6)
+    return Triangle
+
+#-------------------------------------------------
+# TRIANGLEPRINTER( ... )
+# Plot the intermediate polygons b_i^k, k=1,...,degree of a precomputed
+# De Casteljau triangle with a single LineCollection (plus one set of
+# vertex markers). To animate, pass the artists returned by a previous
+# call (same degree) : only their vertex data is updated.
+#
+# Input
+#    Triangle  :  (degree+1) x (degree+1) x 2 tensor from DeCasteljauTriangle()
+#    ax        :  matplotlib axes (current axes by default)
+#    artists   :  (lines, marks) of a previous call, updated in place
+#
+# Output
+#    lines, marks  :  the LineCollection and the vertex markers
+#
+def TrianglePrinter( Triangle, ax=None, artists=None ) :
+
+    degree = Triangle.shape[0]-1
+    polygons = [ Triangle[k,:degree+1-k] for k in range(1,degree+1) ]
+    vertices = np.concatenate(polygons) if degree > 0 else np.empty([0,2])
+
+    # update the given artists
+    if artists is not None :
+        lines, marks = artists
+        lines.set_segments(polygons)
+        marks.set_offsets(vertices)
+        return lines, marks
+
+    if ax is None :
+        ax = plt.gca()
+
+    # one color and line width per depth, as with successive plt.plot calls
+    cycle = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    colors = [ cycle[(depth+1)%len(cycle)] for depth in range(0,degree) ]
+    widths = [ 1.2 if depth%2==0 else 0.6 for depth in range(0,degree) ]
+
+    lines = LineCollection(polygons,colors=colors,linewidths=widths)
+    ax.add_collection(lines)
+    marks = ax.scatter(vertices[:,0],vertices[:,1],s=20,zorder=lines.get_zorder(),
+        c=[ colors[k-1] for k in range(1,degree+1) for i in range(0,degree+1-k) ])
+    ax.autoscale_view()
+
+    return lines, marks
 
 #-------------------------------------------------
 if __name__ == "__main__":
@@ -154,11 +977,11 @@ if __name__ == "__main__":
     else :
         density = 50
 
-    # arg 3 : recursive or iterative DeCasteljau
+    # arg 3 : recursive, iterative or batch DeCasteljau
     if len(sys.argv) > 3 :
-        rec = (True if sys.argv[3]=="rec" else False)
+        method = (sys.argv[3] if sys.argv[3] in ["rec","batch","bernstein","fd"] else "it")
     else :
-        rec = True
+        method = "rec"
 
     # filename
     filename = DATADIR + dataname + ".bcv"
@@ -166,7 +989,7 @@ if __name__ == "__main__":
     # check if valid datafile
     if not os.path.isfile(filename) :
         print ("error:  invalid dataname '" + dataname + "'")
-        print ("usage:  python tp1.py  [simple,infinity,spiral,tuple]  [sampling_density]")
+        print ("usage:  python tp1.py  [simple,infinity,spiral,tuple]  [sampling_density]  [rec,it,batch,bernstein,fd]")
         
     else :
 
@@ -182,7 +1005,7 @@ if __name__ == "__main__":
         BezierPts = ReadPolygon(filename)
 
         # compute curve points
-        CurvePts = BezierCurve(BezierPts,density)
+        CurvePts = BezierCurve(BezierPts,density,method)
 
         # print the control polygon
         plt.plot(BezierPts[:,0], BezierPts[:,1], '-o', linewidth=1.5)
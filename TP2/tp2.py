@@ -23,10 +23,19 @@
 import sys, os
 import matplotlib.pyplot as plt
 import numpy as np
+from collections import OrderedDict
+from numpy.lib.stride_tricks import as_strided
 
 TP = os.path.dirname(os.path.realpath(__file__)) + "/"
 DATADIR = filename = TP+"data/"
 
+# bounded LRU cache of Bernstein matrices, see BernsteinMatrix()
+BERNSTEIN_CACHE = OrderedDict()
+BERNSTEIN_CACHE_SIZE = 32
+
+# factorization of the C2 spline system, computed once, see FactorSplineSystem()
+SPLINE_FACTOR = {}
+
 
 #-------------------------------------------------
 # READPOLYGON()
@@ -41,7 +50,7 @@ DATADIR = filename = TP+"data/"
 def ReadData( filename ) :
     datafile = open(filename,'r');
     l = datafile.readline()
-    degree = np.fromstring(l,sep=' ',dtype=int)
+    degree = int(l)
     DataPts = np.fromfile(datafile,count=2*(degree+1),sep=' ',dtype=float)
     DataPts = DataPts.reshape(-1,2)
     return DataPts
@@ -61,11 +70,75 @@ def ReadData( filename ) :
 #    point b_i^k from the De Casteljau algorithm.
 #
 def DeCasteljau( BezierPts, k, i, t ) :
-    if k==0 :
-        return BezierPts[i,:]
-    else :
-        return (1-t) * DeCasteljau( BezierPts, k-1, i, t )  +  t * DeCasteljau( BezierPts, k-1, i+1, t )
+    # level by level on a copy, each b_j^r once : O(k^2) work
+    points = np.array(BezierPts[i:i+k+1],dtype=float)
+    for depth in range(1,k+1) :
+        points[:k-depth+1] = (1-t)*points[:k-depth+1] + t*points[1:k-depth+2]
+    return points[0]
+
+
+#-------------------------------------------------
+# BERNSTEINBASIS( ... )
+# Compute the Bernstein polynomials B_i^degree(t) at arbitrary parameters
+# (no caching). The recurrence runs on a (degree+1) x N array,
+# so that each step works on contiguous rows.
+#
+# Input
+#    degree    :  degree of the Bernstein basis
+#    samples   :  vector of N curve parameters
+#
+# Output
+#    B         :  N x (degree+1) matrix, B[j,i] = B_i^degree(samples[j])
+#
+def BernsteinBasis( degree, samples ) :
+
+    t = np.asarray(samples,dtype=float).reshape(-1)
+    s = 1.0-t
+
+    # B_i^k = (1-t)*B_i^(k-1) + t*B_(i-1)^(k-1), starting from B_0^0 = 1
+    B = np.zeros([degree+1,t.shape[0]])
+    B[0] = 1.0
+    for k in range(1,degree+1) :
+        B[1:k+1] = s*B[1:k+1] + t*B[0:k]
+        B[0] *= s
 
+    return B.T
+
+#-------------------------------------------------
+# BERNSTEINMATRIX( ... )
+# Compute the matrix of Bernstein polynomials B_i^degree(t)
+# evaluated at the given samples, so that curve points are
+# obtained as  B @ BezierPts.
+# Matrices are kept in a bounded LRU cache keyed by (degree, samples),
+# and are returned read-only.
+#
+# Input
+#    degree    :  degree of the Bernstein basis
+#    samples   :  vector of N curve parameters in [0.0,1.0]
+#
+# Output
+#    B         :  N x (degree+1) matrix, B[j,i] = B_i^degree(samples[j])
+#
+def BernsteinMatrix( degree, samples ) :
+
+    samples = np.ascontiguousarray(samples,dtype=float).reshape(-1)
+    key = (degree, samples.tobytes())
+
+    # cache hit : move the entry to the most recently used position
+    if key in BERNSTEIN_CACHE :
+        B = BERNSTEIN_CACHE.pop(key)
+        BERNSTEIN_CACHE[key] = B
+        return B
+
+    B = BernsteinBasis(degree,samples)
+    B.setflags(write=False)
+
+    # evict the least recently used matrix
+    BERNSTEIN_CACHE[key] = B
+    if len(BERNSTEIN_CACHE) > BERNSTEIN_CACHE_SIZE :
+        BERNSTEIN_CACHE.popitem(last=False)
+
+    return B
 
 #-------------------------------------------------
 # BEZIERCURVE( ... )
@@ -74,12 +147,15 @@ def DeCasteljau( BezierPts, k, i, t ) :
 # Input
 #    BezierPts :  (degree+1) x 2 matrix of Bezier control points
 #    N         :  number of curve samples
+#    method    :  'bernstein' matrix or 'rec' De Casteljau
 #    
 # Output
 #    CurvePts  :  N x 2 matrix of curvepoints
 #
-def BezierCurve( BezierPts, N ) :
+def BezierCurve( BezierPts, N, method='bernstein' ) :
     degree = BezierPts.shape[0]-1
+    if method == 'bernstein' :
+        return BernsteinMatrix( degree, np.linspace(0.0, 1.0, num=N) ).dot( BezierPts )
     CurvePts = np.empty([N,2])
     i=0
     for t in np.linspace(0.0, 1.0, num=N) :
@@ -88,6 +164,184 @@ def BezierCurve( BezierPts, N ) :
     return CurvePts
 
 
+#-------------------------------------------------
+# SPLINESEGMENTS( ... )
+# View the Bezier points of a spline as a stack of control polygons,
+# without copying : consecutive polygons share their end point.
+#
+# Input
+#    BezierPts :  (deg*n+1) x dim matrix of Bezier control points
+#    deg       :  degree of the segments (2 for C1, 3 for C2)
+#
+# Output
+#    Segments  :  n x (deg+1) x dim read-only view
+#
+def SplineSegments( BezierPts, deg ) :
+    BezierPts = np.ascontiguousarray(BezierPts,dtype=float)
+    n = (BezierPts.shape[0]-1)//deg
+    s0, s1 = BezierPts.strides
+    return as_strided( BezierPts, shape=(n,deg+1,BezierPts.shape[1]),
+        strides=(deg*s0,s0,s1), writeable=False )
+
+
+#-------------------------------------------------
+# SPLINECURVE( ... )
+# Evaluate all segments of a Bezier spline with one product with the
+# cached Bernstein matrix, and return a single polyline in which the
+# joints shared by consecutive segments appear only once.
+#
+# Input
+#    BezierPts :  (deg*n+1) x dim matrix of Bezier control points
+#    deg       :  degree of the segments (2 for C1, 3 for C2)
+#    N         :  number of samples per segment (N >= 2)
+#
+# Output
+#    CurvePts  :  (n*(N-1)+1) x dim matrix of curvepoints ; segment i is
+#                 CurvePts[i*(N-1):(i+1)*(N-1)+1]
+#
+def SplineCurve( BezierPts, deg, N ) :
+    Segments = SplineSegments( BezierPts, deg )
+    n, dim = Segments.shape[0], Segments.shape[2]
+    B = BernsteinMatrix( deg, np.linspace(0.0, 1.0, num=N) )
+
+    # the first sample of each segment is the last of the previous one
+    CurvePts = np.empty([n*(N-1)+1,dim])
+    CurvePts[0] = Segments[0,0]
+    np.matmul( B[1:], Segments, out=CurvePts[1:].reshape(n,N-1,dim) )
+    return CurvePts
+
+
+#-------------------------------------------------
+# SPLINEEVALUATE( ... )
+# Evaluate a Bezier spline at arbitrary (unsorted) global parameters.
+# Segment i covers [Breaks[i],Breaks[i+1]] ; the segment of each query is
+# found with np.searchsorted, and all queries are evaluated together,
+# chunk by chunk, with their own Bernstein values.
+# Parameters outside [Breaks[0],Breaks[n]] extrapolate the end segments.
+#
+# Input
+#    BezierPts   :  (deg*n+1) x dim matrix of Bezier control points
+#    deg         :  degree of the segments (2 for C1, 3 for C2)
+#    u           :  vector of M global parameters
+#    Breaks      :  increasing vector of n+1 segment boundaries (0,1,...,n if None)
+#    derivatives :  0, 1 or 2 : number of derivatives (w.r.t. u) to return
+#    chunk       :  number of queries evaluated at once
+#
+# Output
+#    CurvePts    :  M x dim matrix of curvepoints
+#    (CurveDers, CurveDers2)  :  M x dim matrices of derivatives, if asked
+#
+def SplineEvaluate( BezierPts, deg, u, Breaks=None, derivatives=0, chunk=2**18 ) :
+    Segments = SplineSegments( BezierPts, deg )
+    n, dim = Segments.shape[0], Segments.shape[2]
+    if Breaks is None :
+        Breaks = np.arange(n+1,dtype=float)
+    Breaks = np.asarray(Breaks,dtype=float)
+    u = np.asarray(u,dtype=float).reshape(-1)
+
+    # derivatives of the segments, as Bezier curves of lower degree
+    Diffs = [ Segments ]
+    for k in range(1,derivatives+1) :
+        Diffs.append( (deg-k+1)*(Diffs[-1][:,1:]-Diffs[-1][:,:-1]) )
+
+    Result = [ np.empty([u.shape[0],dim]) for k in range(0,derivatives+1) ]
+    for start in range(0,u.shape[0],chunk) :
+        uc = u[start:start+chunk]
+
+        # segment and local parameter of each query
+        seg = np.clip( np.searchsorted(Breaks,uc,side='right')-1, 0, n-1 )
+        h = Breaks[seg+1]-Breaks[seg]
+        t = (uc-Breaks[seg])/h
+
+        for k in range(0,derivatives+1) :
+            B = BernsteinBasis( deg-k, t )
+            Pts = np.einsum( 'qi,qid->qd', B, Diffs[k][seg] )
+            if k > 0 :
+                Pts /= (h**k).reshape(-1,1)
+            Result[k][start:start+chunk] = Pts
+
+    return Result[0] if derivatives == 0 else tuple(Result)
+
+
+#-------------------------------------------------
+# POWERTABLE( ... )
+# Convert a Bezier spline to a table of power-basis coefficients :
+# on segment i,  b(t) = Table[i,0] + Table[i,1] t + ... + Table[i,deg] t^deg.
+# The conversion is one product with the matrix
+#    a_j = C(deg,j) sum_k (-1)^(j-k) C(j,k) b_k.
+#
+# Input
+#    BezierPts :  (deg*n+1) x dim matrix of Bezier control points
+#    deg       :  degree of the segments (2 for C1, 3 for C2)
+#
+# Output
+#    Table     :  n x (deg+1) x dim contiguous float64 array
+#
+def PowerTable( BezierPts, deg ) :
+    Segments = SplineSegments( BezierPts, deg )
+
+    binom = np.ones([deg+1,deg+1])
+    for j in range(1,deg+1) :
+        binom[j,1:j] = binom[j-1,0:j-1] + binom[j-1,1:j]
+    j, k = np.meshgrid( np.arange(deg+1), np.arange(deg+1), indexing='ij' )
+    M = np.where( k <= j, binom[deg,j]*binom[j,np.minimum(k,j)]*(-1.0)**(j-k), 0.0 )
+
+    return np.ascontiguousarray( np.matmul(M,Segments), dtype=np.float64 )
+
+
+#-------------------------------------------------
+# HORNEREVALUATE( ... )
+# Evaluate a power-basis coefficient table (see PowerTable) at arbitrary
+# global parameters, with the Horner scheme on all queries at once.
+# Segment i covers [Breaks[i],Breaks[i+1]], by default [i,i+1].
+#
+# Input
+#    Table     :  n x (deg+1) x dim coefficient table (can be memory-mapped)
+#    u         :  vector of M global parameters
+#    Breaks    :  increasing vector of n+1 segment boundaries (0,1,...,n if None)
+#    chunk     :  number of queries evaluated at once
+#
+# Output
+#    CurvePts  :  M x dim matrix of curvepoints
+#
+def HornerEvaluate( Table, u, Breaks=None, chunk=2**18 ) :
+    n, deg, dim = Table.shape[0], Table.shape[1]-1, Table.shape[2]
+    if Breaks is not None :
+        Breaks = np.asarray(Breaks,dtype=float)
+    u = np.asarray(u,dtype=float).reshape(-1)
+    CurvePts = np.empty([u.shape[0],dim])
+
+    for start in range(0,u.shape[0],chunk) :
+        uc = u[start:start+chunk]
+        if Breaks is None :
+            seg = np.clip( np.floor(uc).astype(int), 0, n-1 )
+            t = (uc-seg).reshape(-1,1)
+        else :
+            seg = np.clip( np.searchsorted(Breaks,uc,side='right')-1, 0, n-1 )
+            t = ((uc-Breaks[seg])/(Breaks[seg+1]-Breaks[seg])).reshape(-1,1)
+
+        Coefs = Table[seg]
+        Pts = np.array(Coefs[:,deg])
+        for j in range(deg-1,-1,-1) :
+            Pts *= t
+            Pts += Coefs[:,j]
+        CurvePts[start:start+chunk] = Pts
+
+    return CurvePts
+
+
+#-------------------------------------------------
+# SAVETABLE( ... ) / LOADTABLE( ... )
+# Store a coefficient table as a .npy file; loading memory-maps it
+# (read-only) by default, so that several processes share the same pages.
+#
+def SaveTable( filename, Table ) :
+    np.save( filename, np.ascontiguousarray(Table,dtype=np.float64) )
+
+def LoadTable( filename, mmap=True ) :
+    return np.load( filename, mmap_mode=('r' if mmap else None) )
+
+
 #-------------------------------------------------
 # COMPUTESPLINEC1( ... )
 # Compute Bezier control points for a C1 quadratic spline interpolating the given data.
@@ -127,10 +381,87 @@ def ComputeSplineC1( DataPts ) :
     return BezierPts
 
 
+#-------------------------------------------------
+# COMPUTESPLINEC1CHUNKED( ... )
+# Same spline as ComputeSplineC1, without Python loops over the points.
+# The recurrence c_i = 2 P_i - c_i-1 on the inner points c_i = b_2i+1
+# unrolls, from the last inner point c_a-1 of the previous chunk, into
+#    c_i = (-1)^(i-a) * ( 2 sum_{j=a..i} (-1)^(j-a) P_j  -  c_a-1 ),
+# i.e. one cumulative sum per chunk. Restarting the sum at each chunk
+# keeps the alternating sums short; a chunk whose residual
+# |c_i + c_i-1 - 2 P_i| exceeds tol (relative to the data) is redone
+# with half the length. Only O(chunk) temporary memory is used, and
+# `out` can be a memory-mapped array for very large inputs.
+#
+# Input
+#    DataPts   : (n+1) x 2 matrix of datapoints P_0,...,P_n
+#    chunk     : number of inner points per chunk
+#    out       : optional (2n+1) x 2 output array
+#    tol       : tolerated relative residual of the recurrence
+#    
+# Output
+#    BezierPts : (2n+1) x 2 matrix of Bezier control points 
+#    residual  : max relative residual of the recurrence
+#
+def ComputeSplineC1Chunked( DataPts, chunk=65536, out=None, tol=1e-12 ) :
+    n = DataPts.shape[0]-1
+    BezierPts = np.empty([2*n+1,DataPts.shape[1]]) if out is None else out
+    residual = 0.0
+
+    # datapoints, chunk by chunk
+    for start in range(0,n+1,chunk) :
+        BezierPts[2*start:2*min(start+chunk,n+1):2] = DataPts[start:start+chunk]
+    if n == 0 :
+        return BezierPts, residual
+
+    # first inner point, then c_1,...,c_n-1
+    carry = 0.5*(DataPts[0]+DataPts[1])
+    BezierPts[1] = carry
+    a = 1
+    while a < n :
+        length = min(chunk,n-a)
+        while True :
+            P = DataPts[a:a+length]
+            sign = np.ones([length,1])
+            sign[1::2] = -1.0
+            C = 2.0*np.cumsum(sign*P,axis=0)
+            C -= carry
+            C *= sign
+
+            # residual of the recurrence, relative to the data magnitude
+            R = np.abs( C[1:]+C[:-1]-2.0*P[1:] ) if length > 1 else np.zeros([0])
+            r0 = np.abs( C[0]+carry-2.0*P[0] )
+            scale = max( np.max(np.abs(P)), np.max(np.abs(carry)), 1e-300 )
+            error = max( np.max(R) if R.size else 0.0, np.max(r0) )/scale
+            if error <= tol or length == 1 :
+                break
+            length = length//2
+
+        BezierPts[2*a+1:2*(a+length)+1:2] = C
+        residual = max(residual,error)
+        carry = C[-1]
+        a += length
+
+    return BezierPts, residual
+
+
 #-------------------------------------------------
 # COMPUTESPLINEC2( ... )
 # Compute Bezier control points for a C2 cubic spline interpolating the given data.
 #
+# The C0, C1, C2 and natural end conditions form a banded (3n+1)x(3n+1) system;
+# e.g. with 4 datapoints and 10 Bezier points A ... J :
+#    A = P_0,  D = P_1,  G = P_2,  J = P_3                      [C0]
+#    C - 2D + E = 0,  F - 2G + H = 0                            [C1]
+#    B - 2C + 2E - F = 0,  E - 2F + 2H - I = 0                  [C2]
+#    A - 2B + C = 0,  H - 2I + J = 0                            [natural]
+# Writing the inner Bezier points with the de Boor points D_0,...,D_n,
+#    b_3i+1 = (2 D_i + D_i+1)/3,   b_3i+2 = (D_i + 2 D_i+1)/3,
+# the C1 and C2 conditions hold by construction, and the rest reduces
+# to the classic tridiagonal system
+#    D_0 = P_0,   D_i-1 + 4 D_i + D_i+1 = 6 P_i  (i=1,...,n-1),   D_n = P_n,
+# solved in O(n) time and memory by SolveSplineSystem().
+#
 # Input
 #    DataPts   : (n+1) x 2 matrix of datapoints P_0,...,P_n
 #    
@@ -140,72 +471,416 @@ def ComputeSplineC1( DataPts ) :
 def ComputeSplineC2( DataPts ) :
 
     # input: DataPts = [P_0; P_1; ... ; P_n]
+    # a stack of one dataset, see ComputeSplineC2Batch()
+    return ComputeSplineC2Batch( np.asarray(DataPts,dtype=float)[np.newaxis] )[0]
+
+
+#-------------------------------------------------
+# COMPUTESPLINEC2CLOSED( ... )
+# Compute Bezier control points for a closed (periodic) C2 cubic spline
+# interpolating the given data. If the last datapoint repeats the first,
+# it is dropped. The de Boor points solve the cyclic system
+#    D_i-1 + 4 D_i + D_i+1 = 6 P_i,   i=0,...,n-1  (indices modulo n),
+# i.e. the tridiagonal system of SolveSplineSystem() plus the two corner
+# entries, which are handled by a rank-2 Sherman-Morrison-Woodbury
+# correction, in O(n).
+#
+# Input
+#    DataPts   : n x 2 matrix of datapoints P_0,...,P_n-1 (n >= 3)
+#    
+# Output
+#              : (3n+1) x 2 matrix of Bezier control points of the n segments;
+#                the last point repeats the first, so that segment i is
+#                BezierPts[3i:3i+4] as for open splines
+#
+def ComputeSplineC2Closed( DataPts ) :
+
+    DataPts = np.asarray(DataPts,dtype=float)
+    if DataPts.shape[0] > 1 and np.all(DataPts[0] == DataPts[-1]) :
+        DataPts = DataPts[:-1]
+    n = DataPts.shape[0]
+    if n < 3 :
+        raise ValueError("closed C2 spline needs at least 3 distinct datapoints")
+
+    # tridiagonal solves : right side, and the columns of U = [e_0, e_n-1]
+    Y = SolveSplineSystem( 6.0*DataPts )
+    U = np.zeros([n,2])
+    U[0,0] = 1.0
+    U[n-1,1] = 1.0
+    Z = SolveSplineSystem( U )
+
+    # corners U V^T with V = [e_n-1, e_0] :  X = Y - Z (I + V^T Z)^-1 V^T Y
+    VZ = np.array([ Z[n-1], Z[0] ])
+    VY = np.array([ Y[n-1], Y[0] ])
+    DeBoorPts = Y - Z.dot( np.linalg.solve( np.eye(2)+VZ, VY ) )
+
+    # close the curve : P_n = P_0, D_n = D_0
+    return BezierFromDeBoor( np.concatenate([DataPts,DataPts[:1]]),
+                             np.concatenate([DeBoorPts,DeBoorPts[:1]]) )
+
+
+#-------------------------------------------------
+# FITSPLINEC2( ... )
+# Least-squares C2 cubic spline with a given number of segments,
+# approximating (not interpolating) many noisy datapoints.
+# The spline is written in the uniform cubic B-spline basis with
+# segments+3 de Boor points E_j, and minimizes
+#    sum_k |S(u_k) - Q_k|^2  +  smoothing * sum_j |E_j-1 - 2 E_j + E_j+1|^2.
+# Each datapoint touches 4 consecutive basis functions, so the normal
+# equations are banded (bandwidth 3) : they are accumulated with np.bincount
+# in O(N) and solved with a banded Cholesky factorization in O(segments).
+#
+# Input
+#    DataPts   : N x dim matrix of datapoints Q_0,...,Q_N-1
+#    segments  : number of Bezier segments of the result
+#    smoothing : weight of the second-difference penalty
+#    params    : parameters u_k in [0,segments] (uniform if None)
+#    
+# Output
+#    BezierPts : (3*segments+1) x dim matrix of Bezier control points 
+#    rms       : root mean square distance of the datapoints to the spline
+#
+def FitSplineC2( DataPts, segments, smoothing=0.0, params=None ) :
+    DataPts = np.asarray(DataPts,dtype=float)
+    N, dim = DataPts.shape
+    M = segments+3
+    if params is None :
+        params = np.linspace(0.0,segments,num=N)
+
+    # segment and uniform cubic B-spline weights of each datapoint
+    seg = np.clip( np.floor(params).astype(int), 0, segments-1 )
+    t = params-seg
+    s = 1.0-t
+    W = np.array([ s**3, 3*t**3-6*t**2+4, -3*t**3+3*t**2+3*t+1, t**3 ])/6.0
+
+    # normal equations : Band[o,j] = A[j,j+o], right side R
+    Band = np.zeros([4,M])
+    R = np.zeros([M,dim])
+    for a in range(0,4) :
+        for b in range(a,4) :
+            Band[b-a] += np.bincount( seg+a, weights=W[a]*W[b], minlength=M )
+        for d in range(0,dim) :
+            R[:,d] += np.bincount( seg+a, weights=W[a]*DataPts[:,d], minlength=M )
+
+    # second-difference penalty
+    if smoothing > 0 and M > 2 :
+        D = np.array([1.0,-2.0,1.0])
+        rows = np.arange(M-2)
+        for a in range(0,3) :
+            for b in range(a,3) :
+                Band[b-a] += smoothing*D[a]*D[b]*np.bincount( rows+a, minlength=M )
+
+    # banded Cholesky A = L L^T, with Low[o,j] = L[j+o,j]
+    Low = np.zeros([4,M])
+    for j in range(0,M) :
+        pivot = Band[0,j] - sum( Low[o,j-o]**2 for o in range(1,4) if j-o >= 0 )
+        if pivot <= 0 :
+            raise ValueError("singular fit : too few datapoints per segment, use smoothing > 0")
+        Low[0,j] = np.sqrt(pivot)
+        for o in range(1,4) :
+            i = j+o
+            if i >= M :
+                break
+            # A[i,j] - sum_k L[i,k] L[j,k]
+            v = Band[o,j] - sum( Low[i-k,k]*Low[j-k,k] for k in range(max(i-3,0),j) )
+            Low[o,j] = v/Low[0,j]
+
+    # L y = R, then L^T E = y
+    E = np.array(R)
+    for j in range(0,M) :
+        for o in range(1,4) :
+            if j-o >= 0 :
+                E[j] -= Low[o,j-o]*E[j-o]
+        E[j] /= Low[0,j]
+    for j in range(M-1,-1,-1) :
+        for o in range(1,4) :
+            if j+o < M :
+                E[j] -= Low[o,j]*E[j+o]
+        E[j] /= Low[0,j]
+
+    # residual
+    Fit = sum( W[a].reshape(-1,1)*E[seg+a] for a in range(0,4) )
+    rms = np.sqrt( np.mean( np.sum((Fit-DataPts)**2,axis=1) ) )
+
+    # junction points and Bezier points of the uniform B-spline
+    Junctions = (E[:-2] + 4.0*E[1:-1] + E[2:])/6.0
+    return BezierFromDeBoor( Junctions, E[1:-1] ), rms
+
+
+#-------------------------------------------------
+# COMPUTESPLINEC2BATCH( ... )
+# Compute the C2 cubic splines of a whole stack of datasets of the same
+# length : all right sides are solved in one pass.
+# The de Boor points D_0 = P_0, D_n = P_n and the interior ones solve
+# the tridiagonal system described in ComputeSplineC2().
+#
+# Input
+#    DataStack : k x (n+1) x dim array, k datasets P_0,...,P_n
+#    
+# Output
+#              : k x (3n+1) x dim array of Bezier control points 
+#
+def ComputeSplineC2Batch( DataStack ) :
+
+    DataStack = np.asarray(DataStack,dtype=float)
+    n = DataStack.shape[1]-1
+
+    # (n+1) x k x dim : the system acts on the first axis
+    DataPts = DataStack.transpose(1,0,2)
+
+    # de Boor points, the two ends are the end datapoints
+    DeBoorPts = np.array(DataPts)
+
+    # right side of the interior equations
+    if n > 1 :
+        R = 6.0*DeBoorPts[1:n]
+        R[0] -= DataPts[0]
+        R[-1] -= DataPts[n]
+        DeBoorPts[1:n] = SolveSplineSystem(R)
+
+    return np.ascontiguousarray( BezierFromDeBoor(DataPts,DeBoorPts).transpose(1,0,2) )
+
+
+#-------------------------------------------------
+# INCREMENTALSPLINEC2
+# C2 cubic spline interpolating a sequence of datapoints which grows,
+# shrinks or moves one point at a time (e.g. telemetry).
+# The de Boor points of ComputeSplineC2() are kept up to date by local
+# re-solves : the influence of a change decays like (2-sqrt(3))^k with
+# the distance k, so only a window of `window` de Boor points on each
+# side of the change is re-solved, with the de Boor points at the window
+# ends kept fixed. With the default window, the neglected change is
+# below 1e-22 of the change itself.
+# Each update returns the range [start,stop) of the Bezier segments
+# that changed, so that only those need to be re-sampled and redrawn.
+#
+class IncrementalSplineC2() :
+
+    def __init__( self, DataPts=None, window=40 ) :
+        self.window = window
+        self.n = -1
+        self.DataPts = np.empty([0,2])
+        self.DeBoorPts = np.empty([0,2])
+        if DataPts is not None and len(DataPts) > 0 :
+            DataPts = np.asarray(DataPts,dtype=float)
+            self.reserve( DataPts.shape[0], DataPts.shape[1] )
+            self.n = DataPts.shape[0]-1
+            self.DataPts[:self.n+1] = DataPts
+            self.DeBoorPts[:self.n+1] = DataPts
+            self.solve( 0, self.n )
+
+    # grow the buffers (doubling) to hold `count` points
+    def reserve( self, count, dim=None ) :
+        if dim is None :
+            dim = self.DataPts.shape[1]
+        if count <= self.DataPts.shape[0] and dim == self.DataPts.shape[1] :
+            return
+        size = max(count,2*self.DataPts.shape[0],16)
+        DataPts = np.empty([size,dim])
+        DeBoorPts = np.empty([size,dim])
+        DataPts[:self.n+1] = self.DataPts[:self.n+1]
+        DeBoorPts[:self.n+1] = self.DeBoorPts[:self.n+1]
+        self.DataPts = DataPts
+        self.DeBoorPts = DeBoorPts
+
+    # re-solve D_lo+1,...,D_hi-1 with D_lo and D_hi fixed
+    def solve( self, lo, hi ) :
+        if hi-lo > 1 :
+            R = 6.0*self.DataPts[lo+1:hi]
+            R[0] -= self.DeBoorPts[lo]
+            R[-1] -= self.DeBoorPts[hi]
+            self.DeBoorPts[lo+1:hi] = SolveSplineSystem(R)
+
+    # number of Bezier segments
+    def segments( self ) :
+        return max(self.n,0)
+
+    # add the datapoint P_n+1 at the end
+    def append( self, P ) :
+        P = np.asarray(P,dtype=float)
+        if self.n < 0 :
+            self.reserve( 1, P.shape[0] )
+        else :
+            self.reserve( self.n+2 )
+        self.n += 1
+        self.DataPts[self.n] = P
+        self.DeBoorPts[self.n] = P
+        lo = max(0,self.n-self.window)
+        self.solve( lo, self.n )
+        return lo, self.n
+
+    # remove the last datapoint
+    def pop( self ) :
+        if self.n < 0 :
+            raise IndexError("pop from an empty spline")
+        P = np.array(self.DataPts[self.n])
+        self.n -= 1
+        if self.n < 0 :
+            return P, (0,0)
+        self.DeBoorPts[self.n] = self.DataPts[self.n]
+        lo = max(0,self.n-self.window)
+        self.solve( lo, self.n )
+        return P, (lo, self.n)
+
+    # move the datapoint P_i
+    def move( self, i, P ) :
+        if not 0 <= i <= self.n :
+            raise IndexError("datapoint index out of range")
+        self.DataPts[i] = P
+        if i == 0 or i == self.n :
+            self.DeBoorPts[i] = P
+        lo = max(0,i-self.window)
+        hi = min(self.n,i+self.window)
+        self.solve( lo, hi )
+        return lo, hi
+
+    # Bezier control points of the segments start,...,stop-1
+    def bezier_points( self, start=0, stop=None ) :
+        if stop is None :
+            stop = self.segments()
+        return BezierFromDeBoor( self.DataPts[start:stop+1], self.DeBoorPts[start:stop+1] )
+
+#-------------------------------------------------
+# BEZIERFROMDEBOOR( ... )
+# Assemble the Bezier control points of a uniform cubic spline
+# from its junction points and de Boor points.
+#
+# Input
+#    DataPts   : (n+1) x dim matrix of junction points P_0,...,P_n
+#    DeBoorPts : (n+1) x dim matrix of de Boor points D_0,...,D_n
+#    
+# Output
+#    BezierPts : (3n+1) x dim matrix of Bezier control points 
+#
+def BezierFromDeBoor( DataPts, DeBoorPts ) :
     n = DataPts.shape[0]-1
-    
-    # matrix of the system
-    M = np.zeros([3*n+1,3*n+1])
-    
-    # right side
-    R = np.zeros([3*n+1,2])
-    
-    ##
-    ## TODO : Fill the matrix of the system M.
-    ##          C0  :  n+1 rows
-    ##          C1  :  n-1 rows
-    ##          C2  :  n-1 rows
-    ##          bd  :    2 rows (natural spline)
-    ##
-    ## with 4 datapoints and 10 Bezier points A ... J,
-    ## the matrix has the following form:
-    ## M =                                               : corresp. equation   [type]
-    ##  |  1   0   0   0   0   0   0   0   0   0  |      : A = A                [C0]
-    ##  |  0   0   0   1   0   0   0   0   0   0  |      : D = D                [C0]
-    ##  |  0   0   0   0   0   0   1   0   0   0  |      : G = G                [C0]
-    ##  |  0   0   0   0   0   0   0   0   0   1  |      : J = J                [C0]
-    ##  |  0   0   1  -2   1   0   0   0   0   0  |      : C - 2D + E = 0       [C1]
-    ##  |  0   0   0   0   0   1  -2   1   0   0  |      : F - 2G + H = 0       [C1]
-    ##  |  0   1  -2   0   2  -1   0   0   0   0  |      : B - 2C + 2E - F = 0  [C2]
-    ##  |  0   0   0   0   1  -2   0   2  -1   0  |      : E - 2F + 2H - I = 0  [C2]
-    ##  |  1  -2   1   0   0   0   0   0   0   0  |      : A - 2B + C = 0       [natural]
-    ##  |  0   0   0   0   0   0   0   1  -2   1  |      : H - 2I + J = 0       [natural]
-    ##
-
-    # C0 : indicate with 1s the location of DataPoints to ensure continuity C0
-    j = 0
-    for i in range(0,n+1) :
-        M[i][j] = 1
-        j += 3
-    
-    # C1 : indicate coefficients to ensure continuity C1
-    j = 2
-    for i in range(n+1,2*n) :
-        M[i][j+0] = 1
-        M[i][j+1] = -2
-        M[i][j+2] = 1
-        j += 3
-    
-    # C2 : indicate coefficients to ensure continuity C2
-    j = 1
-    for i in range(2*n,3*n-1) :
-        M[i][j+0] = 1
-        M[i][j+1] = -2
-        M[i][j+3] = 2
-        M[i][j+4] = -1
-        j += 3
-    
-    # bd : indicate coefficients to ensure natural spline
-    j = 0
-    for i in range(3*n-1,3*n+1) :
-        M[i][j+0] = 1
-        M[i][j+1] = -2
-        M[i][j+2] = 1
-        j = 3*n-2
+    BezierPts = np.empty([3*n+1]+list(DataPts.shape[1:]))
+    BezierPts[0::3] = DataPts
+    BezierPts[1::3] = (2.0*DeBoorPts[:-1] + DeBoorPts[1:])/3.0
+    BezierPts[2::3] = (DeBoorPts[:-1] + 2.0*DeBoorPts[1:])/3.0
+    return BezierPts
+
+
+#-------------------------------------------------
+# SOLVESPLINESYSTEM( ... )
+# Solve the m x m tridiagonal Toeplitz system
+#    X_i-1 + 4 X_i + X_i+1 = R_i,   i=0,...,m-1   (X_-1 = X_m = 0)
+# by Gaussian elimination without pivoting (Thomas algorithm).
+# The elimination coefficients c_i = 1/(4-c_i-1) reach their limit
+# 2-sqrt(3) after a few rows; from there on both sweeps are first-order
+# recurrences with a constant coefficient, evaluated by FirstOrderFilter().
+#
+# Input
+#    R         : m x ... array, right side(s)
+#    Factor    : factorization from FactorSplineSystem() (looked up if None)
+#    
+# Output
+#    X         : m x ... array, solution(s)
+#
+def SolveSplineSystem( R, Factor=None ) :
+    m = R.shape[0]
+    if Factor is None :
+        Factor = FactorSplineSystem()
+    c = Factor['c'][:m]
+    lam = Factor['lam']
+    head = c.shape[0]
+
+    # forward sweep : Y_i = c_i*(R_i - Y_i-1)
+    Y = np.empty([m]+list(R.shape[1:]))
+    Y[0] = c[0]*R[0]
+    for i in range(1,head) :
+        Y[i] = c[i]*(R[i]-Y[i-1])
+    if head < m :
+        Y[head:] = FirstOrderFilter( lam*R[head:], -lam, Y[head-1], Factor['kernel'] )
+
+    # backward sweep : X_i = Y_i - c_i*X_i+1
+    X = np.empty_like(Y)
+    X[m-1] = Y[m-1]
+    if head < m :
+        X[head:] = FirstOrderFilter( Y[head:][::-1], -lam, 0.0, Factor['kernel'] )[::-1]
+    for i in range(min(head,m-1)-1,-1,-1) :
+        X[i] = Y[i]-c[i]*X[i+1]
 
-    # put DataPts to the first (n+1) rows of R
-    R[0:n+1] = DataPts[:]
+    return X
 
-    # return the solution
-    return np.linalg.solve(M, R)
+
+#-------------------------------------------------
+# FACTORSPLINESYSTEM( ... )
+# Factorization of the system of SolveSplineSystem() : the elimination
+# coefficients up to their fixed point (the same for every m, a system of
+# size m uses the first m of them), and the block kernel of the
+# constant-coefficient sweeps. It is computed once and kept in SPLINE_FACTOR.
+#
+# Output
+#    Factor    : dictionary with the coefficients 'c', their limit 'lam'
+#                and the FilterKernel() 'kernel'
+#
+def FactorSplineSystem() :
+
+    if not SPLINE_FACTOR :
+        # elimination coefficients until the fixed point
+        c = [ 0.25 ]
+        while len(c) < 2 or c[-1] != c[-2] :
+            c.append( 1.0/(4.0-c[-1]) )
+        SPLINE_FACTOR.update( c=np.array(c), lam=c[-1], kernel=FilterKernel(-c[-1]) )
+
+    return SPLINE_FACTOR
+
+
+#-------------------------------------------------
+# FILTERKERNEL( ... )
+# Block matrices of FirstOrderFilter() for the coefficient g :
+# the b x b lower triangular matrix T of powers of g,
+# and the column [g, g^2, ..., g^b] applied to the carry.
+#
+def FilterKernel( g, block=64 ) :
+    k = np.arange(block)
+    e = k.reshape(-1,1)-k
+    T = np.where( e >= 0, g**np.maximum(e,0), 0.0 )
+    carry = (g**(k+1)).reshape(-1,1)
+    return T, carry
+
+
+#-------------------------------------------------
+# FIRSTORDERFILTER( ... )
+# Evaluate the recurrence  Y_i = U_i + g*Y_i-1  (i=0,...,m-1)  for |g| < 1.
+# Within a block of b rows, Y = T @ U + [g, g^2, ..., g^b] * (last Y of the
+# previous block), where T is the b x b lower triangular matrix of powers
+# of g : all blocks are done with one matrix product, then a short loop
+# propagates the carries.
+#
+# Input
+#    U         : m x ... array
+#    g         : constant coefficient
+#    Y0        : value of Y_-1
+#    Kernel    : precomputed FilterKernel(g) (block size 64 if None)
+#    
+# Output
+#    Y         : m x ... array
+#
+def FirstOrderFilter( U, g, Y0, Kernel=None ) :
+    if Kernel is None :
+        Kernel = FilterKernel(g)
+    T, carry = Kernel
+    block = T.shape[0]
+
+    m = U.shape[0]
+    nb = (m+block-1)//block
+    shape = U.shape
+    U = U.reshape(m,-1)
+
+    # pad to full blocks
+    Pad = np.zeros([nb*block,U.shape[1]])
+    Pad[:m] = U
+
+    Y = np.matmul( T, Pad.reshape(nb,block,-1) )
+
+    prev = np.zeros(U.shape[1]) + np.reshape(Y0,-1)
+    for b in range(0,nb) :
+        Y[b] += carry*prev
+        prev = Y[b,-1]
+
+    return Y.reshape(nb*block,-1)[:m].reshape(shape)
     
 #-------------------------------------------------
 if __name__ == "__main__":
@@ -227,11 +902,13 @@ if __name__ == "__main__":
     else :
         density = 10
 
-    # arg 3 : C2 continuity
+    # arg 3 : C2 continuity (closed C2 if 'closed')
     if len(sys.argv) > 3 :
         c2 = True
+        closed = (sys.argv[3] == "closed")
     else :
         c2 = False
+        closed = False
     
     # uncomment this for manual C2 mode activation
     # c2 = True
@@ -241,8 +918,8 @@ if __name__ == "__main__":
     
     # check if valid datafile
     if not os.path.isfile(filename) :
-        print "error:  invalid dataname '" + dataname + "'"
-        print "usage:  python tp2.py  [simple,infinity,semi,spiral,tuple]  [sampling_density]  [c2]"
+        print ("error:  invalid dataname '" + dataname + "'")
+        print ("usage:  python tp2.py  [simple,infinity,semi,spiral,tuple]  [sampling_density]  [c2,closed]")
         
     else :    
         # read points to be interpolated
@@ -250,7 +927,11 @@ if __name__ == "__main__":
         n = DataPts.shape[0]-1
 
         # compute Bezier points
-        if c2 :
+        if closed :
+            BezierPts = ComputeSplineC2Closed( DataPts )
+            cstr='closed C2'
+            deg=3
+        elif c2 :
             BezierPts = ComputeSplineC2( DataPts )
             cstr='C2'
             deg=3
@@ -259,16 +940,13 @@ if __name__ == "__main__":
             cstr='C1'
             deg=2
 
-        # for each segment : compute and plot
-        for i in range(0,n*deg,deg) :
+        # compute all segments at once
+        CurvePts = SplineCurve( BezierPts, deg, density )
 
-            # build each control polygon with appropriate dimensions
-            iBezierPts = np.zeros([deg+1,2])
-            iBezierPts[:] = BezierPts[i:i+deg+1]
-            
-            # compute ant plot each segment
-            CurvePts = BezierCurve( iBezierPts, density )
-            plt.plot( CurvePts[:,0], CurvePts[:,1], '-', linewidth=3 )
+        # for each segment : plot
+        for i in range(0,(BezierPts.shape[0]-1)//deg) :
+            iCurvePts = CurvePts[i*(density-1):(i+1)*(density-1)+1]
+            plt.plot( iCurvePts[:,0], iCurvePts[:,1], '-', linewidth=3 )
 
 
         # plot the datapoints
@@ -23,10 +23,19 @@
 import sys, os
 import matplotlib.pyplot as plt
 import numpy as np
+from collections import OrderedDict
 
 TP = os.path.dirname(os.path.realpath(__file__)) + "/"
 DATADIR = filename = TP+"data/"
 
+# bounded LRU cache of B-spline basis matrices, see BSplineBasis()
+BASIS_CACHE = OrderedDict()
+BASIS_CACHE_SIZE = 16
+
+# bounded LRU cache of Bezier extractions, see BezierExtraction()
+EXTRACTION_CACHE = OrderedDict()
+EXTRACTION_CACHE_SIZE = 16
+
 
 #-------------------------------------------------
 # READBSPLINE()
@@ -50,24 +59,17 @@ def ReadBSpline( filename, nurbs=False ) :
         dim=2
         
     # datapoints
-    p = np.fromstring(datafile.readline(),sep=' ',dtype=int)
+    p = int(datafile.readline())
     ControlPts = np.fromfile(datafile,count=dim*p,sep=' ',dtype=float)
     ControlPts = ControlPts.reshape(-1,dim)
     
     # knots
-    k = np.fromstring(datafile.readline(),sep=' ',dtype=int)
+    k = int(datafile.readline())
     Knots = np.fromfile(datafile,count=k,sep=' ',dtype=float)
     
     return ControlPts, Knots
 
 
-def ComputeW( Knots, i, k, t) :
-
-    if Knots[i] < Knots[i+k] :
-        return (t - Knots[i])/(Knots[i+k] - Knots[i])
-    else:
-        return 0
-
 #-------------------------------------------------
 # DEBOOR( ... )
 # Perform the De Boor's algorithm.
@@ -82,21 +84,382 @@ def ComputeW( Knots, i, k, t) :
 # Output
 #   Point d_j^r from the De Boor algorithm.
 #
-#
 # NOTE :
-#   This specification assumes the algorithm will be performed recursively.
-#   Feel free to modify the signature if you want iterative implementation.
-#
+#   The degree is deduced from the array shapes and the triangle
+#   is evaluated by DeBoorIterative.
 #
 def DeBoor( ControlPts, Knots, r, j, t ) :
     k = Knots.shape[0] - ControlPts.shape[0] -1
-    if r==0 :
-        return ControlPts[j,:]
-    else :
-        return (1-ComputeW(Knots, j, k-r+1, t )) * \
-        DeBoor( ControlPts, Knots, r-1, j-1, t )  +  \
-        ComputeW(Knots, j, k-r+1, t ) * \
-        DeBoor( ControlPts, Knots, r-1, j, t )
+    return DeBoorIterative( ControlPts, Knots, k, j, t, r )
+
+
+#-------------------------------------------------
+# DEBOORITERATIVE( ... )
+# Iterative De Boor's algorithm.
+# Runs the triangle d_i^l, i = j-r+l,...,j, level by level in place
+# on a small buffer holding d_j-r^0,...,d_j^0 ; each alpha is computed once.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points
+#    Knots      :  (m+1) x 1 vector of knots
+#    degree     :  degree of the curve, m-n-1
+#    j          :  knot span, t in [t_j,t_j+1]
+#    t          :  curve parameter in [t_j,t_j+1]
+#    r          :  depth of the algorithm (degree if None)
+#
+# Output
+#   Point d_j^r from the De Boor algorithm.
+#
+def DeBoorIterative( ControlPts, Knots, degree, j, t, r=None ) :
+    if r is None :
+        r = degree
+    D = np.array( ControlPts[j-r:j+1], dtype=float )
+    shape = (-1,) + (1,)*(D.ndim-1)
+    for l in range(1,r+1) :
+        # alphas w_i,degree-l+1 (t) of the level
+        i = np.arange(j-r+l,j+1)
+        den = Knots[i+degree-l+1] - Knots[i]
+        w = np.zeros(den.shape)
+        np.divide( t-Knots[i], den, out=w, where=den>0 )
+        w = w.reshape(shape)
+        # d_i^l = (1-w) d_i-1^l-1 + w d_i^l-1
+        D[l:] = (1.0-w)*D[l-1:-1] + w*D[l:]
+    return D[r]
+
+
+#-------------------------------------------------
+# DEBOORBATCH( ... )
+# De Boor's algorithm for many parameters at once.
+# The control points d_j-p,...,d_j of every query are gathered into
+# a (p+1) x dim x Q tensor and the triangle is run on all of them,
+# one level at a time, updating each column in place from the right.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points
+#    Knots      :  (m+1) x 1 vector of knots
+#    degree     :  degree of the curve, m-n-1
+#    J          :  Q x 1 vector of knot spans, T[q] in [t_J[q],t_J[q]+1]
+#    T          :  Q x 1 vector of curve parameters, or
+#                  Q x p matrix of blossom arguments, level l uses T[:,l-1]
+#
+# Output
+#    Q x dim matrix of curve points d_J^p(T)
+#
+def DeBoorBatch( ControlPts, Knots, degree, J, T ) :
+    J = np.asarray(J,dtype=int).reshape(-1)
+    T = np.asarray(T,dtype=float).reshape(J.shape[0],-1)
+    D = ControlPts.T[ :, np.arange(-degree,1).reshape(-1,1) + J ]
+    D = D.transpose(1,0,2).astype(float)
+
+    # knots t_J-p+1,...,t_J+p of every query
+    KJ = Knots[ np.arange(-degree+1,degree+1).reshape(-1,1) + J ]
+    w = np.empty(J.shape)
+    for l in range(1,degree+1) :
+        t = T[:,l-1] if T.shape[1] > 1 else T[:,0]
+        for a in range(degree,l-1,-1) :
+            # alpha of d_i^l, i = J-p+a : (t - t_i)/(t_i+p-l+1 - t_i)
+            lo = KJ[a-1]
+            den = KJ[a+degree-l] - lo
+            w.fill(0.0)
+            np.divide( t-lo, den, out=w, where=den>0 )
+            # d_i^l = d_i-1^l-1 + w (d_i^l-1 - d_i-1^l-1)
+            D[a] -= D[a-1]
+            D[a] *= w
+            D[a] += D[a-1]
+    return D[degree].T
+
+
+#-------------------------------------------------
+# BSPLINECURVE( ... )
+# Sample all non-degenerate segments [t_j,t_j+1] of a B-spline
+# (or NURBS) curve uniformly, with DeBoorBatch.
+# For NURBS, the weights are applied to a homogeneous copy of
+# the control points; ControlPts is left untouched.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points, [x,y,w] if nurbs
+#    Knots      :  (m+1) x 1 vector of knots
+#    density    :  number of samples per segment
+#    nurbs      :  rational curve if True
+#    chunk      :  number of samples evaluated at once
+#
+# Output
+#    Segments   :  s x density x 2 array of curve points,
+#                  one row per non-degenerate segment
+#
+def BSplineCurve( ControlPts, Knots, density, nurbs=False, chunk=2**18 ) :
+    degree = Knots.shape[0] - ControlPts.shape[0] - 1
+    m = Knots.shape[0]-1
+    if nurbs :
+        ControlPts = np.hstack(( ControlPts[:,:-1]*ControlPts[:,-1:], ControlPts[:,-1:] ))
+
+    # non-degenerate segments
+    spans = np.arange(degree,m-degree)
+    spans = spans[ Knots[spans] != Knots[spans+1] ]
+
+    # uniform samples of each segment, np.linspace-like
+    s = np.linspace(0.0,1.0,num=density)
+    T = Knots[spans].reshape(-1,1) + (Knots[spans+1]-Knots[spans]).reshape(-1,1)*s
+    T[:,-1] = Knots[spans+1]
+
+    Segments = np.empty([spans.shape[0],density,ControlPts.shape[1]])
+    step = max(1,chunk//density)
+    for start in range(0,spans.shape[0],step) :
+        J = np.repeat( spans[start:start+step], density )
+        Pts = DeBoorBatch( ControlPts, Knots, degree, J, T[start:start+step].reshape(-1) )
+        Segments[start:start+step] = Pts.reshape(-1,density,ControlPts.shape[1])
+
+    if nurbs :
+        Segments = Segments[:,:,:-1]/Segments[:,:,-1:]
+    return Segments
+
+
+#-------------------------------------------------
+# EVALUATEBSPLINE( ... )
+# Evaluate a B-spline (or NURBS) curve at arbitrary parameters.
+# The knot span of every parameter is found with KnotSpans().
+# Parameters outside [t_p,t_n+1] are extrapolated from the first/last span.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points, [x,y,w] if nurbs
+#    Knots      :  (m+1) x 1 vector of knots
+#    T          :  Q x 1 vector of parameters, in any order
+#    nurbs      :  rational curve if True
+#    chunk      :  number of parameters evaluated at once
+#
+# Output
+#    CurvePts   :  Q x 2 matrix of curve points
+#
+def EvaluateBSpline( ControlPts, Knots, T, nurbs=False, chunk=2**18 ) :
+    degree = Knots.shape[0] - ControlPts.shape[0] - 1
+    if nurbs :
+        ControlPts = np.hstack(( ControlPts[:,:-1]*ControlPts[:,-1:], ControlPts[:,-1:] ))
+    T = np.asarray(T,dtype=float).reshape(-1)
+
+    CurvePts = np.empty([T.shape[0],ControlPts.shape[1]])
+    for start in range(0,T.shape[0],chunk) :
+        Tc = T[start:start+chunk]
+        J = KnotSpans( Knots, degree, Tc )
+        CurvePts[start:start+chunk] = DeBoorBatch( ControlPts, Knots, degree, J, Tc )
+
+    if nurbs :
+        CurvePts = CurvePts[:,:-1]/CurvePts[:,-1:]
+    return CurvePts
+
+
+#-------------------------------------------------
+# KNOTSPANS( ... )
+# Knot span j of every parameter, t_j <= t < t_j+1, found with
+# np.searchsorted ; repeated knots are skipped that way.
+# Spans are clipped to [p, last non-degenerate span], so that the right
+# end of the domain t_n+1 falls in the last non-degenerate span.
+#
+# Input
+#    Knots      :  (m+1) x 1 vector of knots
+#    degree     :  degree p of the curve
+#    T          :  Q x 1 vector of parameters, in any order
+#
+# Output
+#    J          :  Q x 1 vector of knot spans
+#
+def KnotSpans( Knots, degree, T ) :
+    n = Knots.shape[0] - degree - 2
+    spans = np.arange(degree,n+1)
+    last = spans[ Knots[spans] < Knots[spans+1] ][-1]
+    return np.clip( np.searchsorted(Knots,T,side='right')-1, degree, last )
+
+
+#-------------------------------------------------
+# BSPLINEBASIS( ... )
+# Sparse basis (collocation) matrix of the B-spline functions
+# N_i,p(T[s]), computed with the Cox-de Boor recurrence for all samples
+# at once. Each row has p+1 nonzeros N_j-p,p ... N_j,p at columns
+# j-p,...,j, so the matrix is stored as a dense S x (p+1) array of values
+# and the column of the first nonzero of each row.
+# Matrices are kept in a bounded LRU cache keyed by (knots, degree, samples),
+# and are returned read-only.
+#
+# Input
+#    Knots      :  (m+1) x 1 vector of knots
+#    degree     :  degree p of the curve
+#    T          :  S x 1 vector of parameters
+#
+# Output
+#    Values     :  S x (p+1) matrix of nonzero basis values
+#    Start      :  S x 1 vector, column of Values[:,0], i.e. j-p
+#
+def BSplineBasis( Knots, degree, T ) :
+
+    Knots = np.ascontiguousarray(Knots,dtype=float)
+    T = np.ascontiguousarray(T,dtype=float).reshape(-1)
+    key = (Knots.tobytes(), degree, T.tobytes())
+
+    # cache hit : move the entry to the most recently used position
+    if key in BASIS_CACHE :
+        Basis = BASIS_CACHE.pop(key)
+        BASIS_CACHE[key] = Basis
+        return Basis
+
+    J = KnotSpans( Knots, degree, T )
+
+    # Cox-de Boor : N[:,r] = N_j-l+r,l (T), degree l = 1,...,p
+    N = np.zeros([T.shape[0],degree+1])
+    N[:,0] = 1.0
+    Left = [ T-Knots[J+1-l] for l in range(0,degree+1) ]
+    Right = [ Knots[J+l]-T for l in range(0,degree+1) ]
+    temp = np.empty(T.shape)
+    for l in range(1,degree+1) :
+        saved = np.zeros(T.shape)
+        for r in range(0,l) :
+            den = Right[r+1] + Left[l-r]
+            temp.fill(0.0)
+            np.divide( N[:,r], den, out=temp, where=den>0 )
+            N[:,r] = saved + Right[r+1]*temp
+            saved = Left[l-r]*temp
+        N[:,l] = saved
+
+    Start = J-degree
+    N.setflags(write=False)
+    Start.setflags(write=False)
+    Basis = (N, Start)
+
+    # evict the least recently used matrix
+    BASIS_CACHE[key] = Basis
+    if len(BASIS_CACHE) > BASIS_CACHE_SIZE :
+        BASIS_CACHE.popitem(last=False)
+
+    return Basis
+
+
+#-------------------------------------------------
+# BASISEVALUATE( ... )
+# Evaluate B-spline (or NURBS) curves sharing a knot vector and samples
+# with a precomputed sparse basis matrix, see BSplineBasis() :
+# each curve point is a (p+1)-term product of basis values and
+# gathered control points.
+#
+# Input
+#    Basis      :  (Values, Start) pair from BSplineBasis
+#    ControlPts :  (n+1) x dim matrix of control points, [x,y,w] if nurbs,
+#                  or k x (n+1) x dim stack of control polygons
+#    nurbs      :  rational curves if True
+#
+# Output
+#    CurvePts   :  S x 2 matrix of curve points (k x S x 2 for a stack)
+#
+def BasisEvaluate( Basis, ControlPts, nurbs=False ) :
+    Values, Start = Basis
+    if nurbs :
+        ControlPts = np.concatenate(( ControlPts[...,:-1]*ControlPts[...,-1:], ControlPts[...,-1:] ), axis=-1)
+    Idx = Start.reshape(-1,1) + np.arange(Values.shape[1])
+    CurvePts = np.einsum( 'sk,...skd->...sd', Values, ControlPts[...,Idx,:] )
+    if nurbs :
+        CurvePts = CurvePts[...,:-1]/CurvePts[...,-1:]
+    return CurvePts
+
+
+#-------------------------------------------------
+# REFINEKNOTS( ... )
+# Insert many knots at once with the Oslo algorithm.
+# With the refined knot vector tau, the new control point i is the blossom
+# of the curve at (tau_i+1,...,tau_i+p), evaluated on the old knot span mu,
+# t_mu <= tau_i < t_mu+1 : a De Boor triangle whose level l uses tau_i+l.
+# All new control points are computed with one DeBoorBatch per chunk,
+# so inserting k knots costs O((n+k) p^2) with no reallocation.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points, [x,y,w] if nurbs
+#    Knots      :  (m+1) x 1 vector of knots
+#    NewKnots   :  k x 1 vector of knots to insert, in [t_p,t_n+1]
+#    nurbs      :  rational curve if True
+#    chunk      :  number of control points computed at once
+#
+# Output
+#    RefinedPts   :  (n+k+1) x dim matrix of control points, as ReadBSpline
+#    RefinedKnots :  (m+k+1) x 1 vector of knots
+#
+def RefineKnots( ControlPts, Knots, NewKnots, nurbs=False, chunk=2**18 ) :
+    degree = Knots.shape[0] - ControlPts.shape[0] - 1
+    n = ControlPts.shape[0]-1
+    NewKnots = np.asarray(NewKnots,dtype=float).reshape(-1)
+    if np.any(NewKnots < Knots[degree]) or np.any(NewKnots > Knots[n+1]) :
+        raise ValueError("knots to insert must lie in [t_p,t_n+1]")
+    if nurbs :
+        ControlPts = np.hstack(( ControlPts[:,:-1]*ControlPts[:,-1:], ControlPts[:,-1:] ))
+
+    RefinedKnots = np.sort( np.concatenate((Knots,NewKnots)), kind='mergesort' )
+    N = RefinedKnots.shape[0] - degree - 1
+
+    RefinedPts = np.empty([N,ControlPts.shape[1]])
+    for start in range(0,N,chunk) :
+        I = np.arange(start,min(start+chunk,N))
+        J = np.clip( np.searchsorted(Knots,RefinedKnots[I],side='right')-1, degree, n )
+        # blossom arguments tau_i+1,...,tau_i+p
+        X = RefinedKnots[ I.reshape(-1,1) + np.arange(1,degree+1) ]
+        RefinedPts[I] = DeBoorBatch( ControlPts, Knots, degree, J, X )
+
+    if nurbs :
+        RefinedPts[:,:-1] /= RefinedPts[:,-1:]
+    return RefinedPts, RefinedKnots
+
+
+#-------------------------------------------------
+# BEZIEREXTRACTION( ... )
+# Convert a B-spline (or NURBS) curve into one Bezier polygon per
+# non-degenerate knot span : every distinct knot of the domain
+# [t_p,t_n+1] is inserted up to multiplicity p with RefineKnots, after
+# which the control points Q_v-p,...,Q_v of a span [tau_v,tau_v+1)
+# are its Bezier points. Degenerate spans are dropped here.
+# Results are kept in a bounded LRU cache keyed by (ControlPts, Knots, nurbs),
+# and are returned read-only.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points, [x,y,w] if nurbs
+#    Knots      :  (m+1) x 1 vector of knots
+#    nurbs      :  rational curve if True
+#
+# Output
+#    BezierPts  :  s x (p+1) x dim array of Bezier polygons, [x,y,w] if nurbs
+#    Breaks     :  (s+1) x 1 vector, span k is [Breaks[k],Breaks[k+1]]
+#
+def BezierExtraction( ControlPts, Knots, nurbs=False ) :
+
+    ControlPts = np.ascontiguousarray(ControlPts,dtype=float)
+    Knots = np.ascontiguousarray(Knots,dtype=float)
+    key = (ControlPts.shape, ControlPts.tobytes(), Knots.tobytes(), nurbs)
+
+    # cache hit : move the entry to the most recently used position
+    if key in EXTRACTION_CACHE :
+        Extraction = EXTRACTION_CACHE.pop(key)
+        EXTRACTION_CACHE[key] = Extraction
+        return Extraction
+
+    degree = Knots.shape[0] - ControlPts.shape[0] - 1
+    n = ControlPts.shape[0]-1
+
+    # missing multiplicities of the distinct domain knots
+    Domain = Knots[degree:n+2]
+    Values = np.unique(Domain)
+    Counts = np.searchsorted(Knots,Values,side='right') - np.searchsorted(Knots,Values,side='left')
+    NewKnots = np.repeat( Values, np.maximum(degree-Counts,0) )
+    Refined, Tau = RefineKnots( ControlPts, Knots, NewKnots, nurbs )
+
+    # non-degenerate spans of the refined knot vector
+    spans = np.arange(degree,Refined.shape[0])
+    spans = spans[ Tau[spans] < Tau[spans+1] ]
+    BezierPts = Refined[ spans.reshape(-1,1) + np.arange(-degree,1) ]
+    Breaks = np.append( Tau[spans], Tau[spans[-1]+1] )
+
+    BezierPts.setflags(write=False)
+    Breaks.setflags(write=False)
+    Extraction = (BezierPts, Breaks)
+
+    # evict the least recently used extraction
+    EXTRACTION_CACHE[key] = Extraction
+    if len(EXTRACTION_CACHE) > EXTRACTION_CACHE_SIZE :
+        EXTRACTION_CACHE.popitem(last=False)
+
+    return Extraction
 
     
 #-------------------------------------------------
@@ -133,9 +496,9 @@ if __name__ == "__main__":
     
     # check if valid datafile
     if not os.path.isfile(filename) :
-        print " error :  invalid dataname '" + dataname + "'"
-        print " usage :  python tp3.py  [camel,circle,simple,spiral,spiral2]  [sampling_density]"
-        print "          python tp3.py  [circle7,circle9]                     [sampling_density]  nurbs"
+        print(" error :  invalid dataname '" + dataname + "'")
+        print(" usage :  python tp3.py  [camel,circle,simple,spiral,spiral2]  [sampling_density]")
+        print("          python tp3.py  [circle7,circle9]                     [sampling_density]  nurbs")
         
     else :    
         # read B-spline control points and knot sequence
@@ -169,24 +532,12 @@ if __name__ == "__main__":
         ##     [ t_n  , t_n+1 ).
         ##   Beware though : some of these segments can be degenerate! (if t_i == t_i+1)
         ##
-        # loop over segments
-        if nurbs :
-            ControlPts[:,0] *= ControlPts[:,2]
-            ControlPts[:,1] *= ControlPts[:,2]
-        
-        for j in range(degree,m-degree) :
-            if Knots[j] != Knots[j+1]: 
-                # prepare matrix of segment points
-                Segment = np.zeros([density,dim])
-                x = 0
-                for t in np.linspace(Knots[j], Knots[j+1], num=density) :       
-                    Segment[x,:] = DeBoor( ControlPts, Knots, degree, j, t )
-                    x+=1
-                if nurbs :
-                    Segment[:,0] /= Segment[:,2]
-                    Segment[:,1] /= Segment[:,2]
-                # plot the segment
-                plt.plot( Segment[:,0], Segment[:,1], '-',linewidth=3)
+        # evaluate all non-degenerate segments at once
+        Segments = BSplineCurve( ControlPts, Knots, density, nurbs )
+        
+        # plot the segments
+        for Segment in Segments :
+            plt.plot( Segment[:,0], Segment[:,1], '-',linewidth=3)
         
         
         
@@ -69,11 +69,11 @@ def DeCasteljau(M,u,v) :
     return DeCasteljauC(b,n,0,v) 
 
 def DeCasteljauC(BezierPts,k,i,t) :
-    if k==0 :
-        return BezierPts[i]
-    else :
-        return (1-t)*DeCasteljauC(BezierPts,k-1,i,t) +\
-          t*DeCasteljauC(BezierPts,k-1,i+1,t)
+    # bottom-up over the subtriangle b_i..b_i+k, no recursion
+    points = np.array(BezierPts[i:i+k+1],dtype=float)
+    for depth in range(1,k+1) :
+        points[:k-depth+1] = (1-t)*points[:k-depth+1] + t*points[1:k-depth+2]
+    return points[0]
 
 #-------------------------------------------------
 # BEZIERSURF( ... )
@@ -56,7 +56,7 @@ def ReadBSplineMeshWithKnots( datafile, nurbs=False ) :
 
 #-------------------------------------------------
 # DEBOOR( ... )
-# Perform the De Boor's algorithm recursively.
+# Perform the De Boor's algorithm.
 #
 # Input
 #    ControlPts :  (n+1) x 2 matrix of control points
@@ -71,25 +71,44 @@ def ReadBSplineMeshWithKnots( datafile, nurbs=False ) :
 
 def DeBoor( ControlPts, Knots, r, j, t ) :
     k = Knots.shape[0] - ControlPts.shape[0] -1
-    if r==0 :
-        return ControlPts[j]
-    else :
-        # (1-w_j_k-r+1(t)) * d_j-1^(r-1) 
-        #  + w_j_k-r+1(t) * d_j^(r-1) 
-        return (1-ComputeW(Knots, j, k-r+1, t )) * \
-        DeBoor( ControlPts, Knots, r-1, j-1, t )  +  \
-        ComputeW(Knots, j, k-r+1, t ) * \
-        DeBoor( ControlPts, Knots, r-1, j, t )
-
-def ComputeW( Knots, i, k, t) :
-    if Knots[i] < Knots[i+k] :
-        return (t - Knots[i])/(Knots[i+k] - Knots[i])
-    else:
-        return 0
+    return DeBoorIterative( ControlPts, Knots, k, j, t, r )
+
+#-------------------------------------------------
+# DEBOORITERATIVE( ... )
+# Iterative De Boor's algorithm.
+# Runs the triangle d_i^l, i = j-r+l,...,j, level by level in place
+# on a small buffer holding d_j-r^0,...,d_j^0 ; each alpha is computed once.
+#
+# Input
+#    ControlPts :  (n+1) x dim matrix of control points
+#    Knots      :  (m+1) x 1 vector of knots
+#    degree     :  degree of the curve, m-n-1
+#    j          :  knot span, t in [t_j,t_j+1]
+#    t          :  curve parameter in [t_j,t_j+1]
+#    r          :  depth of the algorithm (degree if None)
+#
+# Output
+#   Point d_j^r from the De Boor algorithm.
+#
+def DeBoorIterative( ControlPts, Knots, degree, j, t, r=None ) :
+    if r is None :
+        r = degree
+    D = np.array( ControlPts[j-r:j+1], dtype=float )
+    shape = (-1,) + (1,)*(D.ndim-1)
+    for l in range(1,r+1) :
+        # alphas w_i,degree-l+1 (t) of the level
+        i = np.arange(j-r+l,j+1)
+        den = Knots[i+degree-l+1] - Knots[i]
+        w = np.zeros(den.shape)
+        np.divide( t-Knots[i], den, out=w, where=den>0 )
+        w = w.reshape(shape)
+        # d_i^l = (1-w) d_i-1^l-1 + w d_i^l-1
+        D[l:] = (1.0-w)*D[l-1:-1] + w*D[l:]
+    return D[r]
 
 #-------------------------------------------------
 # DEBOORSURF( ... )
-# Recursive De Boor's algorithm for surfaces.
+# De Boor's algorithm for surfaces, row-vectorized in direction u.
 #
 # Input
 #    M     :  (m+1) x (n+1) coordinate matrix, control points net
@@ -103,17 +122,13 @@ def ComputeW( Knots, i, k, t) :
 #   Point d_(i,j)^(r,s) from De Boor's algorithm.
 # 
 def DeBoorSurf( M, U, V, r, s, i, j, u, v ) :
-    m = M.shape[0]-1
-    n = M.shape[1]-1
-
-    tmp = np.zeros([n+1])
-    k=0
-    # Performing DeBoor n+1 times in direction u
-    for d in range(0,n+1) :
-        tmp[k] = DeBoor(M[:,k], U, r, i, u)
-        k+=1
+    du = U.shape[0] - M.shape[0] -1
+    dv = V.shape[0] - M.shape[1] -1
+
+    # Performing DeBoor in direction u on all n+1 columns at once
+    tmp = DeBoorIterative(M, U, du, i, u, r)
     # Performing DeBoor 1 time in direction v
-    return DeBoor(tmp, V, s, j, v)
+    return DeBoorIterative(tmp, V, dv, j, v, s)
 
 #-------------------------------------------------
 if __name__ == "__main__":